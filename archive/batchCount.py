@@ -0,0 +1,139 @@
+'''
+Purpose: Re-count every election in the vote history and save a summary of each one.
+
+Usage:
+    python batchCount.py                                        # read and write the google sheet
+    python batchCount.py --votes votes.csv --elections elections.csv --out results.parquet
+
+The summary (one row per election: winner, rounds, margin) is written to the
+'Election Results' worksheet so the history can be shown without re-counting.
+'''
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import polars as pl
+
+# The counting engine lives with the main app, one folder up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rankEngine import rankChoice
+
+# Worksheet that holds the summaries
+RESULTS_SHEET = 'Election Results'
+
+def readFile(path):
+    '''Reads a CSV or Parquet export of a worksheet'''
+    if path.lower().endswith('.csv'):
+        return pl.read_csv(path, infer_schema = False)
+    return pl.read_parquet(path)
+
+def readSheets():
+    '''Reads the Vote and Election worksheets from the book club storage'''
+    import dashboardHelper as h
+    sheet = h.connection()
+    votes = sheet.table('Vote').read()
+    elections = sheet.table('Election').read()
+    return votes, elections
+
+def splitElections(votes, elections = None):
+    '''Returns a {election date: name/book/rank dataframe} of every election in the vote history
+    NOTE: A vote belongs to the latest election started on or before the day it was cast.
+          Without an election list, each voting day counts as its own election.'''
+    # Convert the date strings to dates
+    votes = votes.with_columns(
+        pl.col('vote_date').cast(pl.String).str.to_date('%d%b%Y'),
+        pl.col('rank').cast(pl.Int64, strict = False)
+    ).filter(pl.col('rank').is_not_null())
+
+    if elections is None or len(elections) == 0:
+        votes = votes.with_columns(pl.col('vote_date').alias('election_date'))
+    else:
+        dates = elections.select(
+            pl.col('election_date').cast(pl.String).str.to_date('%d%b%Y')
+        ).unique().sort('election_date')
+
+        # Match each vote to its election, falling back on the vote date
+        votes = votes.sort('vote_date').join_asof(
+            dates, left_on = 'vote_date', right_on = 'election_date', strategy = 'backward'
+        ).with_columns(pl.col('election_date').fill_null(pl.col('vote_date')))
+
+    return {
+        key[0]: df.select('name', 'book', 'rank')
+        for key, df in votes.partition_by('election_date', as_dict = True).items()
+    }
+
+def summarize(item):
+    '''Counts one election and returns its summary row'''
+    date, df = item
+    result = rankChoice(df)
+
+    # Margin between the top two books in the last round
+    last = result.rounds[-1]['votes'].to_list()
+    margin = last[0] - (last[1] if len(last) > 1 else 0)
+
+    return {
+        'election_date' : date.strftime('%d%b%Y'),
+        'ballots'       : df['name'].n_unique(),
+        'winner'        : result.winner,
+        'rounds'        : len(result.rounds),
+        'margin'        : margin,
+        'tie_break'     : '/'.join(result.tieBreak)
+    }
+
+def countAll(elections, workers = None):
+    '''Counts every election on a process pool and returns the summary dataframe'''
+    # polars isn't safe to fork once its thread pool is running, so start fresh processes
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = workers, mp_context = context) as pool:
+        rows = list(pool.map(summarize, sorted(elections.items())))
+
+    return pl.DataFrame(rows, schema = {
+        'election_date' : pl.String,
+        'ballots'       : pl.Int64,
+        'winner'        : pl.String,
+        'rounds'        : pl.Int64,
+        'margin'        : pl.Int64,
+        'tie_break'     : pl.String
+    })
+
+def writeSheet(summary):
+    '''Writes the summary to the Election Results worksheet, adding it if needed'''
+    import dashboardHelper as h
+    h.connection().table(RESULTS_SHEET).replace(summary)
+
+    # Writes to the google sheet are queued -- make sure they're sent before we exit
+    # NOTE: There's no queue if everything went to the database
+    if h.writes is not None and (not h.writes.flush(timeout = 120) or h.writes.errors):
+        raise RuntimeError(f'Could not write the {RESULTS_SHEET} worksheet: {h.writes.errors}')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Re-count every election in the vote history')
+    parser.add_argument('--votes', help = 'CSV or Parquet export of the Vote worksheet')
+    parser.add_argument('--elections', help = 'CSV or Parquet export of the Election worksheet')
+    parser.add_argument('--out', help = 'also write the summary to this Parquet file')
+    parser.add_argument('--workers', type = int, help = 'number of processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    # Read the history from files if we were given them, otherwise from the google sheet
+    if args.votes:
+        votes = readFile(args.votes)
+        elections = readFile(args.elections) if args.elections else None
+    else:
+        votes, elections = readSheets()
+
+    start = datetime.datetime.now()
+    summary = countAll(splitElections(votes, elections), args.workers)
+    print(summary)
+    print(f'Counted {len(summary)} elections in {datetime.datetime.now() - start}')
+
+    # Save the results
+    if args.out:
+        summary.write_parquet(args.out)
+    if not args.votes:
+        writeSheet(summary)
+
+if __name__ == '__main__':
+    main()
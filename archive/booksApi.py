@@ -0,0 +1,313 @@
+'''
+Purpose: Client for the Google Books API.
+
+One client holds a pool of keep-alive connections, so searches after the first skip the TLS handshake.
+Every request has a timeout, and lookupMany() runs a batch of searches at once with bounded concurrency.
+Answers can be kept in a searchCache on disk, so a repeat search never leaves the machine.
+Covers are downloaded once, shrunk and kept by volume id in a coverCache.
+
+NOTE: Set BOOKS_API_URL to point the client at a local mock server instead of google.
+'''
+
+import asyncio
+import collections
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Where the searches go
+ENDPOINT = os.environ.get('BOOKS_API_URL', 'https://www.googleapis.com/books/v1/volumes')
+
+# Seconds to wait to connect, and then for the answer
+TIMEOUT = (3.05, 10)
+
+def parseBooks(data):
+    '''Turns a volumes search response into {title: book info}
+    NOTE: Repeated titles get _2, _3... added to them'''
+    books = {}
+
+    # Loop through all the results
+    for book in data['items']:
+
+        # Get the book info for the book in question
+        bookInfo = book['volumeInfo']
+
+        # Get all the book information and add it to the dictionary
+        b = bookInfo.get('title')
+
+        # Check if the book has been added before
+        n = 1
+        while True:
+            # Exit if we have something we haven't seen before
+            if b not in books:
+                break
+
+            # Otherwise reprocess the information
+            else:
+                # Remove the end numbers if we've added them
+                if n >= 10:
+                    b = b[:-3]
+                elif n > 1:
+                    b = b[:-2]
+
+                # Increment
+                n += 1
+
+                # Rename
+                b = f'{b}_{n}'
+
+        # Get the authors and convert to a string
+        authors = bookInfo.get('authors')
+        if authors:
+            authors = ', '.join(author for author in authors)
+
+        books[b] = {
+            'id'            : book.get('id'),
+            'author'        : authors,
+            'pages'         : bookInfo.get('pageCount'),
+            'avgRating'     : bookInfo.get('averageRating'),
+            'ratingCount'   : bookInfo.get('ratingsCount'),
+            'description'   : bookInfo.get('description')
+        }
+
+        try:
+            imageLinks = bookInfo.get('imageLinks')
+            books[b]['image'] = imageLinks.get('thumbnail')
+        except:
+            books[b]['image'] = None
+
+    return books
+
+def normalize(query):
+    '''Returns the cache key for a search, so 'Dune ' and 'dune' are the same search'''
+    return ' '.join(query.casefold().split())
+
+class searchCache:
+    '''Search results kept on disk, least recently used first out
+    NOTE: Each result has the volume id of every book in it'''
+
+    def __init__(self, path, ttl = 7 * 24 * 3600, maxEntries = 5000):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+
+        # The most recent searches are also kept in memory
+        self.memory = collections.OrderedDict()     # query -> (time fetched, result)
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        with self.lock, self.db:
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS searches (query TEXT PRIMARY KEY, result TEXT, fetched REAL, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS searches_used ON searches (used)')
+
+            # Older caches also kept every book by volume id, with no limit on how many
+            self.db.execute('DROP TABLE IF EXISTS volumes')
+
+    def get(self, query):
+        '''Returns the cached result of a search, or None if it's missing or too old'''
+        key = normalize(query)
+        now = time.time()
+        with self.lock:
+            hit = self.memory.get(key)
+            if hit is not None and now - hit[0] < self.ttl:
+                self.memory.move_to_end(key)
+                return hit[1]
+
+            row = self.db.execute('SELECT result, fetched FROM searches WHERE query = ?', (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                return None
+
+            # Mark it as used, for the eviction order
+            with self.db:
+                self.db.execute('UPDATE searches SET used = ? WHERE query = ?', (now, key))
+            result = json.loads(row[0])
+            self.remember(key, row[1], result)
+            return result
+
+    def remember(self, key, fetched, result):
+        '''Keeps a result in memory, dropping the least recently used past maxEntries'''
+        self.memory[key] = (fetched, result)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last = False)
+
+    def put(self, query, result):
+        '''Stores the result of a search'''
+        key = normalize(query)
+        now = time.time()
+        with self.lock, self.db:
+            self.remember(key, now, result)
+            self.db.execute(
+                'INSERT OR REPLACE INTO searches (query, result, fetched, used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(result), now, now)
+            )
+
+            # Drop the least recently used searches past maxEntries
+            self.db.execute(
+                'DELETE FROM searches WHERE query IN (SELECT query FROM searches ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.maxEntries,)
+            )
+
+class booksClient:
+    '''Searches the Google Books API over a pool of reused connections
+    NOTE: Safe to share between sessions -- requests' connection pool is thread safe'''
+
+    def __init__(self, apiKey = None, endpoint = ENDPOINT, timeout = TIMEOUT, poolSize = 16, retries = 2, cache = None):
+        self.apiKey = apiKey
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.poolSize = poolSize
+
+        # Optional searchCache checked before going to google
+        self.cache = cache
+
+        # Keep-alive connections, retrying the errors that are worth another go
+        retry = Retry(
+            total = retries,
+            backoff_factor = 0.3,
+            status_forcelist = [429, 500, 502, 503, 504],
+            allowed_methods = ['GET']
+        )
+        adapter = HTTPAdapter(pool_connections = 4, pool_maxsize = poolSize, max_retries = retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def search(self, query):
+        '''Runs one search and returns the response'''
+        params = {
+            'q'         : query,
+            'country'   : 'US'
+        }
+        if self.apiKey:
+            params['key'] = self.apiKey
+        return self.session.get(self.endpoint, params = params, timeout = self.timeout)
+
+    def lookup(self, title):
+        '''Returns {title: book info} for a search, or a message saying what went wrong
+        NOTE: Errors aren't cached, so the next try goes back to google'''
+        if self.cache is not None:
+            result = self.cache.get(title)
+            if result is not None:
+                return result
+
+        result = self.fetch(title)
+        if self.cache is not None and not (isinstance(result, str) and result.startswith('Error')):
+            self.cache.put(title, result)
+        return result
+
+    def fetch(self, title):
+        '''Runs a search against google and returns the parsed result'''
+        try:
+            response = self.search(title)
+        except requests.Timeout:
+            return 'Error: the Google Books API timed out'
+        except requests.RequestException as e:
+            return f'Error: {e}'
+
+        # Check if the request was successful
+        if response.status_code != 200:
+            return f'Error: {response.status_code}'
+
+        # Check if there are any books in the response
+        data = response.json()
+        if 'items' not in data:
+            return 'No books found for the given title.'
+        return parseBooks(data)
+
+    async def lookupAsync(self, title, limit = None):
+        '''Runs lookup() without blocking the event loop
+        NOTE: limit is an optional semaphore capping how many run at once'''
+        if limit is None:
+            return await asyncio.to_thread(self.lookup, title)
+        async with limit:
+            return await asyncio.to_thread(self.lookup, title)
+
+    async def lookupAll(self, titles, concurrency = 8):
+        '''Looks up many titles at once, at most concurrency at a time
+        NOTE: Returns {title: lookup result} in the order the titles were given'''
+        limit = asyncio.Semaphore(min(concurrency, self.poolSize))
+        results = await asyncio.gather(*(self.lookupAsync(title, limit) for title in titles))
+        return dict(zip(titles, results))
+
+    def lookupMany(self, titles, concurrency = 8):
+        '''lookupAll() for callers that aren't async themselves, like a Streamlit page'''
+        return asyncio.run(self.lookupAll(list(titles), concurrency))
+
+    def close(self):
+        self.session.close()
+
+class coverCache:
+    '''Book covers downloaded once, shrunk to display size and kept on disk by volume id'''
+
+    def __init__(self, folder, client, size = (128, 200), retryAfter = 300):
+        self.folder = folder
+        self.size = size
+        os.makedirs(folder, exist_ok = True)
+
+        # volume id -> when its download failed, so a slow google costs one timeout per cover, not one per page view
+        self.retryAfter = retryAfter
+        self.failed = {}
+        self.lock = threading.Lock()
+
+        # Downloads share the client's connection pool
+        self.client = client
+
+    def path(self, volumeId):
+        '''Returns where the cover for a volume id is kept'''
+        return os.path.join(self.folder, re.sub(r'[^A-Za-z0-9_-]', '_', volumeId) + '.jpg')
+
+    def get(self, volumeId, url):
+        '''Returns the local copy of a cover, downloading it the first time
+        NOTE: Falls back to the url if the download fails, or failed in the last retryAfter seconds,
+              and None if there's no cover'''
+        if not url:
+            return None
+        if not volumeId:
+            return url
+
+        path = self.path(volumeId)
+        if os.path.exists(path):
+            return path
+
+        # Don't wait on a download that failed a moment ago
+        with self.lock:
+            failedAt = self.failed.get(volumeId)
+        if failedAt is not None and time.monotonic() - failedAt < self.retryAfter:
+            return url
+
+        try:
+            # Google hands out http links, but serves the same image over https
+            if url.startswith('http://books.google.'):
+                url = 'https://' + url[len('http://'):]
+            response = self.client.session.get(url, timeout = self.client.timeout)
+            response.raise_for_status()
+
+            # Shrink it and save it -- written to a temp file first so a half written cover is never served
+            image = Image.open(io.BytesIO(response.content)).convert('RGB')
+            image.thumbnail(self.size)
+            temp = f'{path}.{threading.get_ident()}.tmp'
+            image.save(temp, 'JPEG', quality = 85)
+            os.replace(temp, path)
+            return path
+        except Exception:
+            with self.lock:
+                self.failed[volumeId] = time.monotonic()
+            return url
+
+    def prefetch(self, covers, workers = 8):
+        '''Fetches a {volume id: url} batch of covers at once, like a page of search results
+        NOTE: Returns {volume id: what get() returned}'''
+        ids = list(covers)
+        with ThreadPoolExecutor(max_workers = workers) as pool:
+            paths = pool.map(lambda volumeId: self.get(volumeId, covers[volumeId]), ids)
+        return dict(zip(ids, paths))
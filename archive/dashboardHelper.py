@@ -5,10 +5,16 @@ import streamlit as st
 import st_pages
 from streamlit_cookies_controller import CookieController
 import polars as pl
+import atexit
 import datetime
-import requests
+import os
+import threading
 import pygsheets
 
+# Custom Modules
+import booksApi
+import storage
+
 # Import options
 try:
     from key import apiKey, apiFile
@@ -16,6 +22,27 @@ except:
     apiKey = st.secrets['apiKey']
     json = str(st.secrets['json']).replace("'", '"')
 
+# Local database, if there is one -- otherwise everything lives in the google sheet
+database = os.environ.get('BOOK_CLUB_DB')
+
+# Set to use an in-memory stand-in for the google sheet, to try things out offline
+fake = os.environ.get('BOOK_CLUB_FAKE_SHEETS')
+
+# Every session's writes to the google sheet, merged and sent a few times a second
+# NOTE: One per process -- it outlives the cached connection. Started by sheetWrites() once there's a google sheet.
+writes = None
+writesLock = threading.Lock()
+
+def sheetWrites():
+    '''Returns the queue for writes to the google sheet, starting it the first time
+    NOTE: It sends what's left when the process exits'''
+    global writes
+    with writesLock:
+        if writes is None:
+            writes = storage.writeQueue()
+            atexit.register(writes.close)
+        return writes
+
 def main():
     pass
 
@@ -35,7 +62,7 @@ def cookie_main():
     user.resetButton()
 
     # Display the current info
-    df = pl.from_pandas(user.workSheet.get_as_df())
+    df = user.workSheet.read()
     st.dataframe(df)
 
 # Shorthand
@@ -60,61 +87,89 @@ def initAll():
     # Store the google sheet in the session state
     init('sheet', connection())
 
-@st.cache_data(ttl = 3600)
+# Where the search results and covers are kept between runs
+cacheFolder = os.environ.get('BOOK_CLUB_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+
+@st.cache_resource
+def booksClient():
+    '''One Books API client for every session, so they all share its connection pool and search cache'''
+    os.makedirs(cacheFolder, exist_ok = True)
+    cache = booksApi.searchCache(os.path.join(cacheFolder, 'books.db'))
+    return booksApi.booksClient(apiKey, cache = cache)
+
+@st.cache_resource
+def coverCache():
+    '''Shrunk copies of the book covers, shared by every session'''
+    return booksApi.coverCache(os.path.join(cacheFolder, 'covers'), booksClient())
+
+@st.cache_resource(ttl = 3600)
 def connection():
-    '''Establish the connection and return the sheet'''
+    '''Establish the connection and return the sheet
+    NOTE: A resource, not data -- the database connection can't be pickled'''
+    if fake:
+        return sheets(fake = True, database = database)
+
     try:
         # JSON file with the sheet connection details
         file = apiFile
         
         # Create the connection
-        sheet = sheets(file)
+        sheet = sheets(file, database = database)
     except:
         # If we're running on the cloud, use the secrets instead
-        sheet = sheets(json = json)
+        sheet = sheets(json = json, database = database)
 
     return sheet
 
 class sheets:
     '''Class to read and write from the Book Club spreadsheet'''
 
-    def __init__(self, jsonFile: 'str' = None, json: 'str' = None):
-        '''Establish Connection'''
+    def __init__(self, jsonFile: 'str' = None, json: 'str' = None, database: 'str' = None, fake: 'bool' = False):
+        '''Establish Connection
+        NOTE: Given a database file, the data lives there and the google sheet is only synced to
+        NOTE: fake = True swaps the google sheet for an in-memory one'''
 
         # Set up the sheets connection
+        self.sh = None
         if jsonFile:
             self.gc = pygsheets.authorize(service_file = jsonFile)
         elif json:
             self.gc = pygsheets.authorize(service_account_json = json)
 
         # Connect to the Book Club Database
-        self.sh = self.gc.open('Book Club Database')
+        if fake:
+            self.sh = storage.fakeSpreadsheet()
+        elif jsonFile or json:
+            self.sh = self.gc.open('Book Club Database')
+
+        # The worksheet titles are indexed once, here
+        self.google = None
+        if self.sh is not None:
+            self.google = storage.sheetsStorage(self.sh, queue = sheetWrites())
+
+        # Where the data is read from and written to
+        if database:
+            self.store = storage.sqliteStorage(database)
+        else:
+            self.store = self.google
 
-    def getBooks(self):
-        '''Reads the current list of nominees from the database'''
-        # Find the "Suggested Books" sheet
-        n = 0
-        while True:
-            if self.sh[n].title == 'Suggested Books':
-                break
-            n += 1
+    def table(self, title):
+        '''Returns the table for a worksheet'''
+        return self.store.table(title)
 
-        # Read in the sheet and convert to dataframe
-        df = pl.from_pandas(self.sh[n].get_as_df())
+    def sync(self):
+        '''Copies the database out to the google sheet
+        NOTE: Does nothing if the google sheet is where the data lives already'''
+        if self.google is not None and self.store is not self.google:
+            storage.copy(self.store, self.google)
 
-        # Return the dataframe
-        return df, n
+    def getBooks(self):
+        '''Reads the current list of nominees from the database'''
+        return self.table('Suggested Books').read()
 
     def resetNominees(self):
         '''Resets the nominee field to be false for all books'''
-        # Read in the current dataframe
-        df, n = self.getBooks()
-
-        # Reset all 'nominated' fields to False
-        df = df.with_columns(pl.col('nominated').map_elements(lambda x: False, return_dtype = pl.Boolean))
-
-        # Rewrite the data on the sheet
-        self.sh[n].set_dataframe(df.to_pandas(), (1,1))
+        self.table('Suggested Books').updateAll({'nominated': False})
 
     def votingPage(self):
         '''Creates a streamlit page to vote on books'''
@@ -131,12 +186,9 @@ class cookie:
         # Establish connection
         self.sheet = connection()
 
-        # Get the sheetNum variable
+        # Get the table for the Cookie Log
         self.cookieSheet()
 
-        # Save the workSheet for the Cookie Log
-        self.workSheet = self.sheet.sh[self.sheetNum]
-
         # Get the length of the User Log
 
         # Set up the cookie for this user
@@ -150,15 +202,14 @@ class cookie:
 
         # Check that the userID is in the database, if not, clear it's value
         if userID:
-            df = pl.from_pandas(self.workSheet.get_as_df())
-            if len(df.filter(pl.col('cookie') == userID)) == 0:
+            if len(self.workSheet.find('cookie', userID)) == 0:
                 userID = None
 
         if userID:
             self.cookieID = userID
         else:
             # Set a cookie
-            userID = 'user_' + str(len(self.workSheet.get_as_df()))
+            userID = 'user_' + str(self.workSheet.count())
             controller.set('user_cookie', userID)
             self.cookieID = userID
 
@@ -167,25 +218,13 @@ class cookie:
             self.cookieLog()
 
     def cookieSheet(self):
-        '''Returns the sheet number with the cookie log'''
-        # Figure out which sheet is the cookie log
-        n = 0
-        while True:
-            name = self.sheet.sh[n].title 
-            if name == 'User Log':
-                break
-            n += 1
-
-        # Save the data
-        self.sheetNum = n
+        '''Sets the table with the cookie log'''
+        self.workSheet = self.sheet.table('User Log')
 
     def cookieLog(self):
         '''Get, check, and write to the cookie log'''
-        # Pull the cookie log
-        log = pl.from_pandas(self.workSheet.get_as_df())
-
-        # Check if our cookie is on there already
-        check = log.filter(pl.col('cookie') == self.cookieID)
+        # Check if our cookie is on the cookie log already
+        check = self.workSheet.find('cookie', self.cookieID)
         
         # If not, ask the user who they are and then add their info
         if len(check) == 0:
@@ -210,11 +249,8 @@ class cookie:
             }
             data = pl.DataFrame(data)
 
-            # Combine the data together
-            df = pl.concat([log, data], how = 'diagonal_relaxed')
-
-            # Write the data to the cookie log sheet
-            self.workSheet.set_dataframe(df.to_pandas(), (1,1))
+            # Add the user to the cookie log sheet
+            self.workSheet.append(data)
 
             # If we submitted already, refresh the page
             if 'cookieSubmit' in st.session_state and st.session_state['cookieSubmit'] and name != '':
@@ -233,38 +269,20 @@ class cookie:
         except:
             pass
 
-        # Get a dataframe of the current users
-        df = pl.from_pandas(self.workSheet.get_as_df())
-
-        # Find the row with the cookie in question
-        row = df.with_row_index().filter(
-            pl.col('cookie') == self.cookieID
-        )['index'][0]
-
         # Update the user's last logon date
-        df[row, 'last_logon'] = self.date
+        changes = {'last_logon': self.date}
 
         # If the user has voted, update that field as well
         if voted:
-            df[row, 'voted'] = True
+            changes['voted'] = True
 
-        # Write back to the worksheet
-        self.workSheet.set_dataframe(df.to_pandas(), (1,1))
+        # Write it to the row with the cookie in question
+        self.workSheet.update('cookie', self.cookieID, changes)
 
     def resetVotes(self):
         '''Reset the voted status for all users'''
-        # Get the dataframe of current cookies
-        df = pl.from_pandas(self.workSheet.get_as_df())
-
         # Reset the values to False for the voted column
-        df = df.with_columns(
-            pl.col('voted').map_elements(
-                lambda x: False, return_dtype = pl.Boolean
-            )
-        )
-
-        # Write back to the sheet
-        self.workSheet.set_dataframe(df.to_pandas(), (1,1))
+        self.workSheet.updateAll({'voted': False})
 
     def voteButton(self):
         st.button('Vote', key = 'vote', on_click = self.updateUser)
@@ -283,56 +301,22 @@ class vote:
         self.votingPages()
 
         # Get the user's name
-        df = pl.from_pandas(self.user.workSheet.get_as_df())
-
-        # Filter for the user
-        df = df.filter(pl.col('cookie') == self.user.cookieID)
+        df = self.user.workSheet.find('cookie', self.user.cookieID)
 
         # Check that we got a result
         if len(df) > 0: 
             self.name = df['name'][0]
 
-            # Set up the sheet to track votes
-            self.voteSheet = self.sheet.sh[self.voteSheetNum]
-
-            # Set up the sheet to track Elections
-            self.electionSheet = self.sheet.sh[self.electionSheetNum]
-
     def votingPages(self):
-        '''Get the Election and Vote sheet numbers'''
+        '''Get the Election and Vote tables'''
         # Set up the sheet
         self.sheet = self.user.sheet
 
-        # Find our sheets
-        n = 0
-        found = 0
-
-        # Loop until we find everything
-        while True:
-
-            # Get the name of the current sheet
-            name = self.sheet.sh[n].title 
+        # Set up the sheet to track votes
+        self.voteSheet = self.sheet.table('Vote')
 
-            # Check if it's one of the sheets we're looking for
-            if name == 'Election':
-                self.electionSheetNum = n
-                found += 1
-            elif name == 'Vote':
-                self.voteSheetNum = n
-                found += 1
-
-            # If we've found all the items, exit
-            if found >= 2:
-                break
-            
-            # Increment
-            n += 1
-
-            # Error Condition
-            if n > 100:
-                st.error("Did not find the following sheets:")
-                st.error("Election & Vote")
-                break
+        # Set up the sheet to track Elections
+        self.electionSheet = self.sheet.table('Election')
 
     def vote(self, userVote):
         '''Take the vote information and write it to the sheet'''
@@ -343,9 +327,6 @@ class vote:
         # Init the variable
         st.session_state['vote'] = False
 
-        # Read in the current data
-        df = pl.from_pandas(self.voteSheet.get_as_df())
-
         # Make a dataframe of the user's vote
         data = {
             'name'      : [],
@@ -369,11 +350,8 @@ class vote:
         # Make the dataframe
         data = pl.DataFrame(data)
 
-        # Combine the data togther
-        df = pl.concat([df, data], how = 'diagonal_relaxed')
-
         # Write the new data to the vote sheet
-        self.voteSheet.set_dataframe(df.to_pandas(), (1,1))
+        self.voteSheet.append(data)
 
         # Update the user's vote status
         st.session_state['vote'] = True
@@ -381,18 +359,14 @@ class vote:
 
     def checkVote(self):
         '''Check if the user has already voted'''
-        # Pull the data
-        df = pl.from_pandas(
-            self.user.workSheet.get_as_df()
-        )
+        # Pull the rows with the user's name
+        df = self.user.workSheet.find('name', self.name)
 
         # Convert the voted status to an integer
         df = df.with_columns(pl.col('voted').replace({'FALSE' : 0, 'TRUE' : 1}).cast(pl.Int64))
 
         # Get the vote status for the user's name
-        voteStatus = df.filter(
-            pl.col('name') == self.name
-        )['voted'].sum()
+        voteStatus = df['voted'].sum()
 
         # If anyone with the user's name has voted, that counts as this user having voted
         voteStatus = True if voteStatus >= 1 else False
@@ -402,8 +376,7 @@ class vote:
 
     def currentElection(self):
         '''Gets the current nominees for the current or previous election'''
-        sheet = self.electionSheet
-        df = pl.from_pandas(sheet.get_as_df())
+        df = self.electionSheet.read()
 
         # Convert the date string to a datetime
         df = df.with_columns(
@@ -420,117 +393,28 @@ class bookSummary:
     
     def __init__(self):
         self.apiKey = apiKey
+        self.books = booksClient()
+        self.covers = coverCache()
         self.sheet = connection()
         self.bookSheet()
 
     def get_book_info(self, title):
-        # Define the endpoint
-        endpoint = "https://www.googleapis.com/books/v1/volumes"
-
-        # Set up the parameters
-        params = {
-            'q': title,  # Query with the book title
-            'key': apiKey,  # Replace with your Google Books API key
-            'country'   : 'US'
-        }
-
-        # Make the request to the API
-        response = requests.get(endpoint, params=params)
-
-        # Check if the request was successful
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Check if there are any books in the response
-            if 'items' in data:
-
-                # Set up a dataframe
-                books = {}
-
-                # Loop through all the results
-                for book in data['items']:
-
-                    # Get the book info for the book in question
-                    bookInfo = book['volumeInfo']
-
-                    # Get all the book information and add it to the dictionary
-                    b = bookInfo.get('title')
-
-                    # Check if the book has been added before
-                    n = 1
-                    while True:
-                        # Exit if we have something we haven't seen before
-                        if b not in books:
-                            break
-
-                        # Otherwise reprocess the information
-                        else:
-                            # Remove the end numbers if we've added them
-                            if n >= 10:
-                                b = b[:-3]
-                            elif n > 1:
-                                b = b[:-2]
-
-                            # Increment
-                            n += 1
-
-                            # Rename
-                            b = f'{b}_{n}'
-
-                    # Get the authors and convert to a string
-                    authors = bookInfo.get('authors')
-                    if authors:
-                        authors = ', '.join(author for author in authors)
-
-                    books[b] = {
-                        'id'            : book.get('id'),
-                        'author'        : authors,
-                        'pages'         : bookInfo.get('pageCount'),
-                        'avgRating'     : bookInfo.get('averageRating'),
-                        'ratingCount'   : bookInfo.get('ratingsCount'),
-                        'description'   : bookInfo.get('description')
-                    }
-
-                    try:
-                        imageLinks = bookInfo.get('imageLinks')
-                        books[b]['image'] = imageLinks.get('thumbnail')
-                    except:
-                        books[b]['image'] = None
-
-                return books
-            else:
-                return 'No books found for the given title.', None
-        else:
-            return f'Error: {response.status_code}', None
+        '''Searches the Google Books API for a title
+        NOTE: Returns {title: book info}, or a message string if nothing was found or something went wrong'''
+        return self.books.lookup(title)
 
     def bookSheet(self):
-        '''Sets the worksheet and sheet number for the Suggested Books Page'''
-        # Figure out which sheet is the cookie log
-        n = 0
-        while True:
-            name = self.sheet.sh[n].title 
-            if name == 'Suggested Books':
-                break
-            n += 1
-
-        # Save the data
-        self.sheetNum = n
-
-        self.workSheet = self.sheet.sh[self.sheetNum]
+        '''Sets the table for the Suggested Books Page'''
+        self.workSheet = self.sheet.table('Suggested Books')
 
     def writeBookInfo(self, book, bookInfo):
         '''Writes the given book info to the google sheet
         NOTE: If a book already exists on the page, returns 1'''
-        # Get the current book data
-        df = pl.from_pandas(
-            self.workSheet.get_as_df()
-        )
+        # Check if the book is on the list already -- an index lookup, not a read of the sheet
+        if self.workSheet.contains('id', bookInfo['id']):
 
-        # Check if the book is on the list already
-        if bookInfo['id'] in df['id'].unique().to_list():
-            
             # Get the book's victory status
-            victorious = df.filter(pl.col('id') == bookInfo['id'])['victorious'][0]
+            victorious = self.workSheet.find('id', bookInfo['id'])['victorious'][0]
 
             # If the book is on the list, check if it's won before
             if victorious != '':
@@ -562,12 +446,8 @@ class bookSummary:
             'victorious'        : ''
         })
 
-        # Get the last row of the current sheet
-        cells = self.workSheet.get_all_values(include_tailing_empty_rows=False, include_tailing_empty=False, returnas='matrix')
-        last_row = len(cells)
-
         # Append the row to the spreadsheet
-        self.workSheet.insert_rows(last_row, number = 1, values = list(data.row(0)))
+        self.workSheet.append(data)
 
         # If success... party time
         st.balloons()
@@ -575,6 +455,10 @@ class bookSummary:
         # Return 0 on successful execution
         return 0
 
+    def prefetchCovers(self, info):
+        '''Downloads the covers for a page of search results at once'''
+        self.covers.prefetch({bookInfo['id']: bookInfo['image'] for bookInfo in info.values() if bookInfo['id']})
+
     def apiDisplayBookInfo(self, book, bookInfo):
         '''Displays the book information from the API in a more organized format'''
         # Display the book title
@@ -583,8 +467,8 @@ class bookSummary:
         # Make the columns
         col1, col2, col3 = st.columns([0.25, 0.25, 0.5])
 
-        # Display the image, if there is one
-        image = bookInfo['image']
+        # Display the image, if there is one -- from the local copy
+        image = self.covers.get(bookInfo['id'], bookInfo['image'])
         if image:
             with col1:
                 st.image(image)
@@ -616,9 +500,7 @@ class bookSummary:
     def dbDisplayBookInfo(self, book):
         '''Displays the book information stored in the google sheet database'''
         # Get the data for this book
-        df = pl.from_pandas(
-            self.workSheet.get_as_df()
-        ).filter(pl.col('book') == book)
+        df = self.workSheet.find('book', book)
 
         # Display the book title
         st.write(f'# {df['book']}')
@@ -626,8 +508,8 @@ class bookSummary:
         # Make the columns
         col1, col2, col3 = st.columns([0.25, 0.25, 0.5])
 
-        # Display the image, if there is one
-        image = df['image'][0]
+        # Display the image, if there is one -- from the local copy
+        image = self.covers.get(df['id'][0], df['image'][0])
         if image:
             with col1:
                 st.image(image)
@@ -38,6 +38,9 @@ def main():
         st.session_state['b'] = b
         st.session_state['info'] = info
 
+        # Fetch all the covers at once rather than one by one as they're drawn
+        b.prefetchCovers(info)
+
         for book in info:
             # Display the book information
             b.apiDisplayBookInfo(book, info[book])
@@ -18,7 +18,7 @@ def main():
     sheet = st.session_state['sheet']
 
     # Read in the current book list
-    df, sheetNum = sheet.getBooks()
+    df = sheet.getBooks()
 
     # Columns
     col1, col2 = st.columns(2)
@@ -59,14 +59,8 @@ def main():
         # Get the book title of the unnominated book
         book = current['book'][n]
 
-        # Get the row of the book that was just selected
-        row = df.with_row_index().filter(pl.col('book') == book)['index'][0]
-
-        # Update the value
-        df[row, 'nominated'] = False
-
-        # Write the data
-        sheet.sh[sheetNum].set_dataframe(df.to_pandas(), (1, 1))
+        # Update the value for the book that was just selected
+        sheet.table('Suggested Books').update('book', book, {'nominated': False})
 
         # Reset the page to reflect the changes
         st.rerun()
@@ -94,14 +88,8 @@ def main():
         # Get the name of the book that was selected
         book = unnominated['book'][n]
 
-        # Get the row of the book that was just selected
-        row = df.with_row_index().filter(pl.col('book') == book)['index'][0]
-
-        # Update the value
-        df[row, 'nominated'] = True
-
-        # Write the data
-        sheet.sh[sheetNum].set_dataframe(df.to_pandas(), (1,1))  
+        # Update the value for the book that was just selected
+        sheet.table('Suggested Books').update('book', book, {'nominated': True})
 
         # Reset the page
         st.rerun()
@@ -129,27 +117,8 @@ def startElection():
     # Current sheet
     sheet = st.session_state['sheet']
 
-    # Get the election sheet number
-    n = 0
-    while True:
-        name = sheet.sh[n].title
-        if name == 'Election':
-            break
-
-        # Increment
-        n += 1
-
-    # Store the election sheet
-    election = sheet.sh[n]
-
-    # Read in the current data
-    df = pl.from_pandas(election.get_as_df())
-
-    # Add the new data
-    df = pl.concat([df, temp], how = 'diagonal_relaxed')
-
-    # Write the data back
-    election.set_dataframe(df.to_pandas(), (1, 1))
+    # Add the new data to the election sheet
+    sheet.table('Election').append(temp)
 
     # If success... party time
     st.snow()
@@ -158,17 +127,10 @@ def startElection():
     reset()
 
     # Reset users vote status
-    n = 0
-    while True:
-        name = sheet.sh[n].title
-        if name == 'User Log':
-            break
-        n += 1
-    df = pl.from_pandas(sheet.sh[n].get_as_df())
-    df = df.with_columns(
-        pl.col('voted').map_elements(lambda x: False, return_dtype = pl.Boolean)
-    )
-    sheet.sh[n].set_dataframe(df.to_pandas(), (1, 1))
+    sheet.table('User Log').updateAll({'voted': False})
+
+    # Copy the finished round of nominations out to the google sheet, if it's only a backup
+    sheet.sync()
 
 if __name__ == '__main__':
     h.initAll()
@@ -30,9 +30,7 @@ def main():
         # Display the current results
         if v.checkVote():
             # Pull the data
-            df = pl.from_pandas(
-                v.voteSheet.get_as_df()
-            )
+            df = v.voteSheet.read()
 
             # Filter for the votes casted today
             df = df.filter(
@@ -42,6 +40,9 @@ def main():
             # Rank choice voting
             rankChoice(df)
 
+            # Past winners, from the batch count
+            history(v)
+
             # Stop the page generation
             return
 
@@ -84,13 +85,26 @@ def main():
     # Refresh the page
     st.rerun()
 
+def history(v):
+    '''Shows the summary of past elections written by batchCount.py'''
+    # If the batch count hasn't been run yet, there's nothing to show
+    try:
+        df = v.sheet.table('Election Results').read()
+    except:
+        return
+    if len(df) == 0:
+        return
+
+    st.write("# Past elections")
+    st.dataframe(df, hide_index = True)
+
 def getNominees():
     '''Get the nominees'''
     # Establish connection
     sheet = st.session_state['sheet']
 
     # Read the current nominees
-    df, sheetNum = sheet.getBooks()
+    df = sheet.getBooks()
 
     # Get the list of current nominees
     current = df.filter(
@@ -105,49 +119,23 @@ def getNominees():
 
 def rankChoice(df, round = 1, scale = None):
     '''Run the ranked choice algorithm'''
-    # Keep track of the rounds
-    results = {}
-
-    # Find the highest ranked vote for each person
-    for name in df['name'].unique().to_list():
-        subset = df.filter(pl.col('name') == name)
-        lowestRank = float('inf')
-        book = None
-
-        # Just look at the results for that person
-        for n in range(len(subset)):
-            rank = subset['rank'][n]
-
-            # The lower a rank value is, the higher the value of the choice
-            if rank != None and rank < lowestRank:
-                lowestRank = rank
-                book = subset['book'][n]
-
-        
-        # If we got a book, add it to our results
-        if book:
-            if book not in results:
-                results[book] = 1
-            else:
-                results[book] += 1
-
-    # Convert the results to a dataframe
-    r = {
-        'book'  : [],
-        'votes' : []
-    }
-    for book in results:
-        r['book'].append(book)
-        r['votes'].append(results[book])
+    # Find the highest ranked vote for each person -- the lowest rank value
+    # is the most preferred choice -- and count how many people picked each book
+    results = (
+        df.filter(pl.col('rank').is_not_null())
+        .group_by('name')
+        .agg(pl.col('book').get(pl.col('rank').arg_min()))
+        .filter(pl.col('book').is_not_null())
+        ['book']
+        .value_counts(name = 'votes')
+    )
 
     # Add any books that didn't get votes back in
-    for book in df['book'].unique().to_list():
-        if book not in r['book']:
-            r['book'].append(book)
-            r['votes'].append(0)
-
-    # Convert the round results to a dataframe
-    r = pl.DataFrame(r)
+    r = (
+        df.select(pl.col('book').unique())
+        .join(results, on = 'book', how = 'left')
+        .with_columns(pl.col('votes').fill_null(0).cast(pl.Int64))
+    )
 
     # Add the percentage to the dataframe
     r = r.with_columns(
@@ -0,0 +1,785 @@
+'''
+Purpose: Where the book club data lives -- a local SQLite database or the google sheet.
+
+Both backends hand out one table per worksheet with the same few operations,
+so the dashboard helpers don't need to know which one they're talking to:
+    read()                          every row as a dataframe
+    find(column, value)             the rows where column == value
+    contains(column, value)         whether any row has column == value, from an index
+    count()                         number of rows
+    append(rows)                    add rows at the end
+    update(column, value, changes)  set {column: value} changes on the rows where column == value
+    updateAll(changes)              set {column: value} changes on every row
+    replace(df)                     swap out everything for the given dataframe
+
+Writes to the google sheet can go through a writeQueue, which merges every session's writes
+and sends them a few times a second. fakeSpreadsheet stands in for google to try it all offline.
+
+Usage:
+    python storage.py book_club.db --pull       # copy the google sheet into the database
+    python storage.py book_club.db --push       # copy the database out to the google sheet
+'''
+
+import argparse
+import sqlite3
+import threading
+import time
+import numpy as np
+import polars as pl
+
+# Worksheet -> {column: SQLite type}, in the same column order as the google sheet
+TABLES = {
+    'User Log'          : {
+        'name'              : 'TEXT',
+        'cookie'            : 'TEXT',
+        'last_logon'        : 'TEXT',
+        'voted'             : 'TEXT'
+    },
+    'Vote'              : {
+        'name'              : 'TEXT',
+        'vote_date'         : 'TEXT',
+        'book'              : 'TEXT',
+        'rank'              : 'INTEGER'
+    },
+    'Election'          : {
+        'book'              : 'TEXT',
+        'election_date'     : 'TEXT'
+    },
+    'Suggested Books'   : {
+        'book'              : 'TEXT',
+        'id'                : 'TEXT',
+        'author'            : 'TEXT',
+        'pages'             : 'INTEGER',
+        'description'       : 'TEXT',
+        'image'             : 'TEXT',
+        'date_suggested'    : 'TEXT',
+        'times_voted_on'    : 'INTEGER',
+        'nominated'         : 'TEXT',
+        'victorious'        : 'TEXT'
+    },
+    'Election Results'  : {
+        'election_date'     : 'TEXT',
+        'ballots'           : 'INTEGER',
+        'winner'            : 'TEXT',
+        'rounds'            : 'INTEGER',
+        'margin'            : 'INTEGER',
+        'tie_break'         : 'TEXT'
+    }
+}
+
+# Columns the helpers look rows up by
+INDEXES = [
+    ('User Log', 'cookie'),
+    ('User Log', 'name'),
+    ('Vote', 'name'),
+    ('Suggested Books', 'id'),
+    ('Election', 'election_date')
+]
+
+# SQLite type -> polars type
+DTYPES = {
+    'TEXT'      : pl.String,
+    'INTEGER'   : pl.Int64
+}
+
+def cell(value):
+    '''Converts a value to the way the google sheet shows it
+    NOTE: The pages compare against 'TRUE' and 'FALSE', so booleans are stored as those strings'''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    return value
+
+def frame(rows):
+    '''Turns a dataframe, a dict of columns or a list of row dicts into a dataframe, converted like cell()'''
+    df = rows if isinstance(rows, pl.DataFrame) else pl.DataFrame(rows)
+    return df.with_columns(
+        pl.col(column).cast(pl.String).str.to_uppercase()
+        for column, dtype in df.schema.items() if dtype == pl.Boolean
+    )
+
+class sqliteStorage:
+    '''Every worksheet as a table in one SQLite database'''
+
+    def __init__(self, path):
+        # One connection shared by every session, so writes go one at a time
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.lock = threading.RLock()
+
+        with self.lock, self.db:
+            # Readers don't wait on the writer, and a commit doesn't need a full fsync
+            self.db.execute('PRAGMA journal_mode = WAL')
+            self.db.execute('PRAGMA synchronous = NORMAL')
+
+            # Make the tables and their indexes if they're not there yet
+            for title, columns in TABLES.items():
+                schema = ', '.join(f'"{column}" {kind}' for column, kind in columns.items())
+                self.db.execute(f'CREATE TABLE IF NOT EXISTS "{title}" ({schema})')
+            for title, column in INDEXES:
+                name = f'{title} {column}'.replace(' ', '_').lower()
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{title}" ("{column}")')
+
+    def table(self, title):
+        '''Returns the table for a worksheet'''
+        if title not in TABLES:
+            raise KeyError(f'No table for the {title} worksheet')
+        return sqliteTable(self, title)
+
+class sqliteTable:
+    '''One worksheet's rows in the SQLite database'''
+
+    def __init__(self, storage, title):
+        self.storage = storage
+        self.title = title
+        self.columns = TABLES[title]
+
+    def check(self, column):
+        '''Makes sure a column name is real before it goes in a query'''
+        if column not in self.columns:
+            raise KeyError(f'{self.title} has no {column} column')
+        return f'"{column}"'
+
+    def query(self, sql, params = ()):
+        '''Runs a select and returns the rows as a dataframe'''
+        with self.storage.lock:
+            rows = self.storage.db.execute(sql, params).fetchall()
+        return pl.DataFrame(
+            rows,
+            schema = {column: DTYPES[kind] for column, kind in self.columns.items()},
+            orient = 'row'
+        )
+
+    def write(self, sql, params):
+        '''Runs one statement per set of params in a single transaction'''
+        with self.storage.lock, self.storage.db:
+            self.storage.db.executemany(sql, params)
+
+    def read(self):
+        columns = ', '.join(f'"{column}"' for column in self.columns)
+        return self.query(f'SELECT {columns} FROM "{self.title}" ORDER BY rowid')
+
+    def find(self, column, value):
+        columns = ', '.join(f'"{column}"' for column in self.columns)
+        return self.query(
+            f'SELECT {columns} FROM "{self.title}" WHERE {self.check(column)} = ? ORDER BY rowid',
+            (cell(value),)
+        )
+
+    def contains(self, column, value):
+        with self.storage.lock:
+            return self.storage.db.execute(
+                f'SELECT 1 FROM "{self.title}" WHERE {self.check(column)} = ? LIMIT 1',
+                (cell(value),)
+            ).fetchone() is not None
+
+    def count(self):
+        with self.storage.lock:
+            return self.storage.db.execute(f'SELECT COUNT(*) FROM "{self.title}"').fetchone()[0]
+
+    def insert(self, rows):
+        '''Returns the insert statement and its params for some rows'''
+        # Only the columns the table has, as the types it stores -- blank numbers become NULL
+        df = frame(rows)
+        columns = [column for column in df.columns if column in self.columns]
+        df = df.select(pl.col(column).cast(DTYPES[self.columns[column]], strict = False) for column in columns)
+
+        names = ', '.join(f'"{column}"' for column in columns)
+        marks = ', '.join('?' for _ in columns)
+        return f'INSERT INTO "{self.title}" ({names}) VALUES ({marks})', df.rows()
+
+    def append(self, rows):
+        sql, params = self.insert(rows)
+        if params:
+            self.write(sql, params)
+
+    def update(self, column, value, changes):
+        sets = ', '.join(f'{self.check(key)} = ?' for key in changes)
+        self.write(
+            f'UPDATE "{self.title}" SET {sets} WHERE {self.check(column)} = ?',
+            [[cell(new) for new in changes.values()] + [cell(value)]]
+        )
+
+    def updateAll(self, changes):
+        sets = ', '.join(f'{self.check(key)} = ?' for key in changes)
+        self.write(f'UPDATE "{self.title}" SET {sets}', [[cell(new) for new in changes.values()]])
+
+    def replace(self, df):
+        sql, params = self.insert(df)
+        with self.storage.lock, self.storage.db:
+            self.storage.db.execute(f'DELETE FROM "{self.title}"')
+            if params:
+                self.storage.db.executemany(sql, params)
+
+def label(row, column):
+    '''Returns the A1 label of a cell, counting rows and columns from 1'''
+    letters = ''
+    while column:
+        column, n = divmod(column - 1, 26)
+        letters = chr(ord('A') + n) + letters
+    return f'{letters}{row}'
+
+def changes(old, new):
+    '''Returns the cells that differ between two frames of the same shape as {(row, column): value}
+    NOTE: Rows and columns count from 1 like the sheet does, and row 1 is the header'''
+    cells = {}
+    for j, column in enumerate(new.columns):
+        # Compare as text, so a column read back as numbers matches the numbers we wrote
+        a = old[column].cast(pl.String)
+        b = new[column].cast(pl.String)
+        values = new[column]
+        for i in np.flatnonzero(a.ne_missing(b).to_numpy()):
+            cells[(int(i) + 2, j + 1)] = values[int(i)]
+    return cells
+
+def ranges(cells):
+    '''Groups {(row, column): value} cells into (A1 range, values) pairs
+    NOTE: Neighbouring cells in a column are sent as one range'''
+    pairs = []
+    for column in sorted({j for _, j in cells}):
+        rows = np.array(sorted(i for i, j in cells if j == column))
+
+        # Split the rows into runs of neighbours
+        for run in np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1):
+            start, stop = int(run[0]), int(run[-1])
+            values = [['' if cells[(i, column)] is None else cells[(i, column)]] for i in range(start, stop + 1)]
+            pairs.append((f'{label(start, column)}:{label(stop, column)}', values))
+    return pairs
+
+class sheetBatch:
+    '''Writes waiting to go to one worksheet: a full rewrite, new rows and changed cells, sent in that order'''
+
+    def __init__(self, replace = None, appends = None, cells = None):
+        self.replace = replace          # dataframe to rewrite the sheet with
+        self.appends = appends or []    # rows of values to add at the end
+        self.cells = cells or {}        # {(row, column): value} to change
+
+    def __len__(self):
+        return (0 if self.replace is None else len(self.replace)) + len(self.appends) + len(self.cells)
+
+    def merge(self, newer):
+        '''Adds a later batch on top of this one
+        NOTE: A later rewrite makes everything before it moot'''
+        if newer.replace is not None:
+            self.replace, self.appends, self.cells = newer.replace, [], {}
+        self.appends = self.appends + newer.appends
+        self.cells = {**self.cells, **newer.cells}
+        return self
+
+    def send(self, workSheet):
+        '''Makes the writes, one call for each kind
+        NOTE: Each part is cleared once it's sent, so a retry doesn't add the rows twice'''
+        if self.replace is not None:
+            workSheet.clear()
+            workSheet.set_dataframe(self.replace.to_pandas(), (1, 1))
+            self.replace = None
+        if self.appends:
+            workSheet.append_table(self.appends, start = 'A1', dimension = 'ROWS', overwrite = False)
+            self.appends = []
+        if self.cells:
+            pairs = ranges(self.cells)
+            workSheet.update_values_batch([r for r, _ in pairs], [v for _, v in pairs])
+            self.cells = {}
+
+class writeQueue:
+    '''Collects the writes of every session and sends them to google a few times a second
+    NOTE: The writes to each worksheet are merged, so a burst of votes costs one call per worksheet.
+          Writers wait once too much is queued, and a failed batch is retried with a growing delay.'''
+
+    def __init__(self, interval = 0.3, maxPending = 5000, retries = 8, maxDelay = 30):
+        self.interval = interval
+        self.maxPending = maxPending
+        self.retries = retries
+        self.maxDelay = maxDelay
+
+        self.pending = {}       # title -> sheetBatch
+        self.targets = {}       # title -> (worksheet, frameCache)
+        self.failures = {}      # title -> failed sends in a row
+        self.errors = []        # batches given up on, as (title, exception)
+        self.size = 0
+
+        # Numbered writes, so flush() can wait for the ones before it
+        self.queued = 0
+        self.done = 0
+
+        self.cond = threading.Condition()
+        self.closing = False
+        self.thread = threading.Thread(target = self.run, name = 'sheet writes', daemon = True)
+        self.thread.start()
+
+    def submit(self, workSheet, cache, batch):
+        '''Queues a batch of writes for a worksheet, waiting first if the queue is full'''
+        with self.cond:
+            while self.size >= self.maxPending and not self.closing:
+                self.cond.wait()
+
+            title = workSheet.title
+            self.targets[title] = (workSheet, cache)
+            if title in self.pending:
+                self.size -= len(self.pending[title])
+                self.pending[title].merge(batch)
+            else:
+                self.pending[title] = batch
+            self.size += len(self.pending[title])
+            self.queued += 1
+            self.cond.notify_all()
+
+    def run(self):
+        '''Sends whatever has been queued, every interval'''
+        delay = self.interval
+        while True:
+            with self.cond:
+                while not self.pending and not self.closing:
+                    self.cond.wait()
+                if self.closing and not self.pending:
+                    return
+
+            # Give the other sessions a moment to add their writes -- or stop waiting if we're closing
+            with self.cond:
+                self.cond.wait_for(lambda: self.closing, delay)
+
+            with self.cond:
+                work, self.pending, self.size = self.pending, {}, 0
+                upTo = self.queued
+                self.cond.notify_all()
+
+            failed = {}
+            for title, batch in work.items():
+                workSheet, cache = self.targets[title]
+                try:
+                    batch.send(workSheet)
+                    self.failures.pop(title, None)
+                except Exception as e:
+                    self.failures[title] = self.failures.get(title, 0) + 1
+
+                    # Give up after a few tries, or straight away when closing -- the cached frame no longer matches the sheet
+                    if self.failures[title] > self.retries or self.closing:
+                        self.failures.pop(title)
+                        self.errors.append((title, e))
+                        cache.drop(title)
+                    else:
+                        failed[title] = batch
+
+            with self.cond:
+                # Put the failed writes back in front of anything newer
+                for title, batch in failed.items():
+                    if title in self.pending:
+                        self.size -= len(self.pending[title])
+                        batch.merge(self.pending[title])
+                    self.pending[title] = batch
+                    self.size += len(batch)
+
+                if failed:
+                    delay = min(delay * 2, self.maxDelay)
+                else:
+                    delay = self.interval
+                    self.done = upTo
+                self.cond.notify_all()
+
+    def flush(self, timeout = None):
+        '''Waits until everything queued so far has been sent
+        NOTE: Returns False if that took longer than the timeout, or the writer thread has stopped'''
+        with self.cond:
+            target = self.queued
+            self.cond.wait_for(lambda: self.done >= target or not self.thread.is_alive(), timeout)
+            return self.done >= target
+
+    def close(self, timeout = 30):
+        '''Sends what's left and stops the writer thread
+        NOTE: Each write left gets one more try, and we stop waiting after the timeout'''
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+class frameCache:
+    '''Decoded worksheets, kept for a while so a page view fetches each worksheet at most once
+    NOTE: Our own writes replace the cached frame, so only other processes' writes wait out the ttl'''
+
+    def __init__(self, ttl = 60):
+        self.ttl = ttl
+        self.frames = {}    # title -> (time it was read, dataframe)
+        self.lock = threading.Lock()
+
+        # Kept up to date by our own appends, so they outlive the ttl -- a fresh read rebuilds them
+        self.counts = {}    # title -> number of rows
+        self.indexes = {}   # (title, column) -> {value: first row}
+
+        # Only a replace changes a worksheet's header, so it's kept until one does
+        self.headers = {}   # title -> column names in row 1
+
+        # title -> lock held while a frame is read, changed and written back
+        self.writers = {}
+
+    def writing(self, title):
+        '''Returns the lock that keeps two sessions from changing the same worksheet at once'''
+        with self.lock:
+            return self.writers.setdefault(title, threading.RLock())
+
+    def get(self, title, load):
+        '''Returns the cached frame for a worksheet, calling load() to fetch it if it's missing or stale'''
+        with self.lock:
+            hit = self.frames.get(title)
+        if hit is not None and time.monotonic() - hit[0] < self.ttl:
+            return hit[1]
+
+        df = load()
+        self.put(title, df)
+        return df
+
+    def put(self, title, df):
+        '''Stores the frame we just read from or wrote to a worksheet'''
+        with self.lock:
+            self.frames[title] = (time.monotonic(), df)
+            self.counts[title] = len(df)
+            self.headers[title] = list(df.columns)
+
+            # Rebuilt from this frame the next time they're asked for
+            for key in [key for key in self.indexes if key[0] == title]:
+                del self.indexes[key]
+
+    def appended(self, title, df):
+        '''Adds the rows we just appended to the cached frame, the row count and the indexes'''
+        with self.lock:
+            hit = self.frames.get(title)
+            if hit is not None:
+                self.frames[title] = (hit[0], pl.concat([hit[1], df], how = 'diagonal_relaxed'))
+
+            start = self.counts.get(title)
+            if start is None:
+                return
+            self.counts[title] = start + len(df)
+
+            for (t, column), index in self.indexes.items():
+                if t != title:
+                    continue
+                values = df[column].to_list() if column in df.columns else [None] * len(df)
+                for n, value in enumerate(values):
+                    index.setdefault(value, start + n)
+
+    def header(self, title, load):
+        '''Returns the header of a worksheet, calling load() to fetch it the first time'''
+        with self.lock:
+            header = self.headers.get(title)
+        if header is not None:
+            return header
+
+        header = list(load())
+        with self.lock:
+            return self.headers.setdefault(title, header)
+
+    def count(self, title):
+        '''Returns the row count we know for a worksheet, or None'''
+        with self.lock:
+            return self.counts.get(title)
+
+    def index(self, title, column, load):
+        '''Returns {value: first row} for a column, building it from the cached frame the first time
+        NOTE: Only reads the worksheet if there's no index and the frame has gone stale'''
+        # Holding the writing lock so no append lands between reading the frame and indexing it
+        with self.writing(title):
+            with self.lock:
+                index = self.indexes.get((title, column))
+            if index is not None:
+                return index
+
+            df = self.get(title, load)
+            index = {}
+            if column in df.columns:
+                for n, value in enumerate(df[column].to_list()):
+                    index.setdefault(value, n)
+            with self.lock:
+                self.indexes[(title, column)] = index
+            return index
+
+    def drop(self, title = None):
+        '''Forgets one worksheet, or all of them'''
+        with self.lock:
+            if title is None:
+                self.frames.clear()
+                self.counts.clear()
+                self.indexes.clear()
+                self.headers.clear()
+            else:
+                self.frames.pop(title, None)
+                self.counts.pop(title, None)
+                self.headers.pop(title, None)
+                for key in [key for key in self.indexes if key[0] == title]:
+                    del self.indexes[key]
+
+class sheetsStorage:
+    '''Every worksheet of the google sheet'''
+
+    def __init__(self, sh, ttl = 60, queue = None):
+        # The pygsheets spreadsheet
+        self.sh = sh
+
+        # Shared by every table, so each session reads from the same frames
+        self.cache = frameCache(ttl)
+
+        # Writes go out through the queue if there is one, otherwise straight away
+        self.queue = queue
+
+        # title -> worksheet, from the worksheet list fetched when the spreadsheet was opened
+        self.lock = threading.Lock()
+        self.worksheets = {}
+        self.index()
+
+    def index(self, fetch = False):
+        '''Rebuilds the title -> worksheet map
+        NOTE: fetch = True asks google for the worksheet list again, in one call'''
+        if fetch:
+            self.sh.fetch_properties()
+        self.worksheets = {workSheet.title: workSheet for workSheet in self.sh.worksheets()}
+
+    def worksheet(self, title, create = False):
+        '''Returns the worksheet with a title, or None if there isn't one
+        NOTE: Only a miss goes back to google -- someone may have added or renamed a tab.
+              create = True adds the tab if it's still missing.'''
+        with self.lock:
+            if title not in self.worksheets:
+                self.index(fetch = True)
+            if title not in self.worksheets:
+                if not create:
+                    return None
+                self.worksheets[title] = self.sh.add_worksheet(title)
+            return self.worksheets[title]
+
+    def table(self, title):
+        '''Returns the table for a worksheet
+        NOTE: The tab is looked up on first use, and only replace() adds a missing one'''
+        return sheetTable(self, title)
+
+class sheetTable:
+    '''One worksheet of the google sheet'''
+
+    def __init__(self, storage, title):
+        self.storage = storage
+        self.title = title
+        self.cache = storage.cache
+        self.queue = storage.queue
+        self.workSheet = None
+
+    def sheet(self, create = False):
+        '''Returns the worksheet, or None if the spreadsheet doesn't have it (see sheetsStorage.worksheet)'''
+        if self.workSheet is None:
+            self.workSheet = self.storage.worksheet(self.title, create)
+        return self.workSheet
+
+    def headerRow(self):
+        '''Reads just the first row of the worksheet from google'''
+        if self.sheet() is None:
+            return []
+        return self.workSheet.get_row(1, include_tailing_empty = False)
+
+    def fetch(self):
+        '''Reads the whole worksheet from google
+        NOTE: A missing tab reads as an empty frame, and that's cached like any other read'''
+        if self.sheet() is None:
+            return pl.DataFrame()
+        return pl.from_pandas(self.workSheet.get_as_df())
+
+    def read(self):
+        return self.cache.get(self.title, self.fetch)
+
+    def find(self, column, value):
+        return self.read().filter(pl.col(column) == cell(value))
+
+    def contains(self, column, value):
+        return cell(value) in self.cache.index(self.title, column, self.fetch)
+
+    def count(self):
+        # Our appends keep the count up to date, so it only needs a read the first time
+        n = self.cache.count(self.title)
+        return len(self.read()) if n is None else n
+
+    def submit(self, batch, df):
+        '''Sends a batch of writes and caches the frame they leave behind
+        NOTE: With a write queue the frame is cached right away, so this process sees its writes before google does'''
+        workSheet = self.sheet()
+        if self.queue is not None:
+            self.queue.submit(workSheet, self.cache, batch)
+        else:
+            # If the write fails part way, we no longer know what's on the sheet
+            try:
+                batch.send(workSheet)
+            except Exception:
+                self.cache.drop(self.title)
+                raise
+
+        if df is not None:
+            self.cache.put(self.title, df)
+
+    def append(self, rows):
+        '''Adds the rows after the last row of the sheet in one call, without reading the sheet
+        NOTE: Google appends server side, so two sessions appending at once both keep their rows'''
+        df = frame(rows)
+        with self.cache.writing(self.title):
+            self.appendFrame(df)
+
+    def appendFrame(self, df):
+        '''Appends a dataframe of rows -- call with the worksheet's writing lock held'''
+        # Line the values up under the sheet's header -- read once, rather than trusting the live sheet to match TABLES
+        # NOTE: A blank or missing tab has no header
+        header = self.cache.header(self.title, self.headerRow)
+
+        # A blank sheet or a new column needs the header written too
+        if not header or not set(df.columns) <= set(header):
+            old = self.read()
+            if not old.columns and self.title in TABLES:
+                old = pl.DataFrame(schema = list(TABLES[self.title]))
+            return self.replace(pl.concat([old, df], how = 'diagonal_relaxed'))
+
+        values = [
+            ['' if value is None else value for value in row]
+            for row in df.select(pl.col(column) if column in df.columns else pl.lit(None).alias(column) for column in header).rows()
+        ]
+
+        # Add the rows to the cached frame, row count and indexes
+        self.submit(sheetBatch(appends = values), None)
+        self.cache.appended(self.title, df)
+
+    def update(self, column, value, changes):
+        match = pl.col(column) == cell(value)
+        self.write(lambda df: df.with_columns(
+            pl.when(match).then(pl.lit(cell(new))).otherwise(pl.col(key)).alias(key)
+            for key, new in changes.items()
+        ))
+
+    def updateAll(self, changes):
+        self.write(lambda df: df.with_columns(
+            pl.lit(cell(new)).alias(key) for key, new in changes.items()
+        ))
+
+    def write(self, change):
+        '''Applies change(df) to the cached frame and sends only the cells that differ, in one batched update
+        NOTE: Falls back to rewriting the sheet if the rows or columns changed'''
+        with self.cache.writing(self.title):
+            # Nothing to change on a tab that isn't there
+            old = self.read()
+            if self.sheet() is None:
+                return
+            df = change(old)
+            if old.columns != df.columns or len(old) != len(df):
+                return self.replace(df)
+
+            cells = changes(old, df)
+            if cells:
+                self.submit(sheetBatch(cells = cells), df)
+
+    def replace(self, df):
+        # The only write that adds a missing tab -- it writes the header along with the rows
+        with self.cache.writing(self.title):
+            self.sheet(create = True)
+            self.submit(sheetBatch(replace = df), df)
+
+class fakeWorksheet:
+    '''In-memory stand-in for a pygsheets worksheet -- just the calls sheetTable makes
+    NOTE: Every call sleeps for latency seconds, to act like a round trip to google'''
+
+    def __init__(self, title, latency = 0):
+        self.title = title
+        self.latency = latency
+        self.values = []        # header row and then the data rows
+        self.calls = {}         # method -> times it was called
+        self.lock = threading.Lock()
+
+    def call(self, name):
+        '''Counts a call and waits like google would'''
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        time.sleep(self.latency)
+
+    def get_as_df(self):
+        self.call('get_as_df')
+        import pandas as pd
+        with self.lock:
+            if not self.values:
+                return pd.DataFrame()
+            return pd.DataFrame([list(row) for row in self.values[1:]], columns = self.values[0])
+
+    def get_row(self, row, include_tailing_empty = True):
+        self.call('get_row')
+        with self.lock:
+            values = list(self.values[row - 1]) if len(self.values) >= row else []
+        while values and values[-1] == '' and not include_tailing_empty:
+            values.pop()
+        return values
+
+    def clear(self):
+        self.call('clear')
+        with self.lock:
+            self.values = []
+
+    def set_dataframe(self, df, start):
+        self.call('set_dataframe')
+        with self.lock:
+            self.values = [list(df.columns)] + [
+                ['' if value is None else value for value in row]
+                for row in df.astype(object).where(df.notna(), None).values.tolist()
+            ]
+
+    def append_table(self, values, start = 'A1', dimension = 'ROWS', overwrite = False):
+        self.call('append_table')
+        with self.lock:
+            self.values += [list(row) for row in values]
+
+    def update_values_batch(self, ranges, values):
+        self.call('update_values_batch')
+        with self.lock:
+            for crange, block in zip(ranges, values):
+                # Only single column ranges like C4:C9 are ever sent
+                first = crange.split(':')[0]
+                letters = first.rstrip('0123456789')
+                row = int(first[len(letters):])
+                column = 0
+                for letter in letters:
+                    column = column * 26 + ord(letter) - ord('A') + 1
+
+                for i, (value,) in enumerate(block):
+                    self.values[row - 1 + i][column - 1] = value
+
+class fakeSpreadsheet:
+    '''In-memory stand-in for the pygsheets spreadsheet, to try the sheets backend offline'''
+
+    def __init__(self, latency = 0):
+        self.latency = latency
+        self.sheets = []
+
+        # Start with the worksheets the dashboard expects, headers and all
+        for title, columns in TABLES.items():
+            self.add_worksheet(title).values = [list(columns)]
+
+    def worksheets(self):
+        return list(self.sheets)
+
+    def fetch_properties(self):
+        time.sleep(self.latency)
+
+    def add_worksheet(self, title):
+        workSheet = fakeWorksheet(title, self.latency)
+        self.sheets.append(workSheet)
+        return workSheet
+
+def copy(source, target, titles = TABLES):
+    '''Copies every worksheet from one storage to the other'''
+    for title in titles:
+        target.table(title).replace(source.table(title).read())
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Copy the book club data between SQLite and the google sheet')
+    parser.add_argument('database', help = 'SQLite database file')
+    group = parser.add_mutually_exclusive_group(required = True)
+    group.add_argument('--pull', action = 'store_true', help = 'copy the google sheet into the database')
+    group.add_argument('--push', action = 'store_true', help = 'copy the database out to the google sheet')
+    args = parser.parse_args()
+
+    import dashboardHelper as h
+    sheet = sheetsStorage(h.connection().sh)
+    database = sqliteStorage(args.database)
+
+    if args.pull:
+        copy(sheet, database)
+    else:
+        copy(database, sheet)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+'''
+Purpose: Benchmark the ranked choice engine on synthetic elections.
+
+Usage:
+    python benchmark.py                 # run every case and compare to the baseline
+    python benchmark.py --quick         # skip the million ballot cases
+    python benchmark.py --save          # store this run as the new baseline
+    python benchmark.py --case tie      # only run cases with 'tie' in the name
+
+NOTE: rankEngine doesn't import streamlit, so no Streamlit script context is needed.
+NOTE: Each case is counted in its own process, so its peak resident memory includes polars' buffers.
+      tracemalloc's number is also shown, but it only sees python objects and numpy arrays.
+'''
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import polars as pl
+
+# Custom Modules
+from rankEngine import rankChoice
+
+# Where the baseline numbers are kept
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Slowdown or growth in memory (current / baseline) that counts as a regression
+TOLERANCE = 1.25
+
+# Extra MB a count can take over the baseline before it counts as a regression, to ignore noise on small cases
+SLACK_MB = 16
+
+def books(nBooks):
+    '''Returns nBooks book titles'''
+    return [f'Book {n:03d}' for n in range(nBooks)]
+
+def ballotFrame(prefs, lengths, titles):
+    '''Turns a voter x preference matrix of book ids into a name/book/rank dataframe
+    NOTE: Only the first lengths[v] preferences of voter v are kept'''
+    nVoters, width = prefs.shape
+    keep = np.arange(width)[None, :] < lengths[:, None]
+    voters, positions = np.nonzero(keep)
+    return pl.DataFrame({
+        'name'  : voters + 1,
+        'book'  : pl.Series(titles, dtype = pl.String).cast(pl.Enum(titles)).gather(prefs[voters, positions]),
+        'rank'  : (positions + 1).astype(np.int16)
+    })
+
+def popular(nVoters, nBooks, maxLength, full, seed):
+    '''Ballots where some books are a lot more popular than others
+    NOTE: Draws each ranking from a Plackett-Luce model with Zipf weights'''
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, nBooks + 1)
+
+    # Sorting exponential arrival times gives a weighted random ranking
+    width = nBooks if full else min(maxLength, nBooks)
+    prefs = np.empty((nVoters, width), dtype = np.int32)
+    chunk = max(1, 2_000_000 // nBooks)
+    for start in range(0, nVoters, chunk):
+        stop = min(start + chunk, nVoters)
+        times = rng.exponential(size = (stop - start, nBooks)) / weights
+        prefs[start:stop] = np.argsort(times, axis = 1)[:, :width]
+
+    # Partial ballots rank anywhere from 1 to width books
+    if full:
+        lengths = np.full(nVoters, width)
+    else:
+        lengths = rng.integers(1, width + 1, size = nVoters)
+
+    return ballotFrame(prefs, lengths, books(nBooks))
+
+def ties(nVoters, nBooks, seed):
+    '''Every book gets the same number of single-choice ballots
+    NOTE: Nobody can be eliminated, so this goes straight to the mean rank and random tie break'''
+    prefs = (np.arange(nVoters) % nBooks).astype(np.int32)[:, None]
+    return ballotFrame(prefs, np.ones(nVoters, dtype = np.int64), books(nBooks))
+
+def exhausting(nVoters, nBooks, seed):
+    '''Short ballots spread evenly over many books
+    NOTE: Most ballots run out of choices early, so the count takes many small rounds'''
+    rng = np.random.default_rng(seed)
+
+    # Two different books per ballot, only some voters bother with the second
+    first = rng.integers(0, nBooks, size = nVoters)
+    second = (first + rng.integers(1, nBooks, size = nVoters)) % nBooks
+    prefs = np.stack([first, second], axis = 1).astype(np.int32)
+    return ballotFrame(prefs, rng.integers(1, 3, size = nVoters), books(nBooks))
+
+# name -> function building the election
+CASES = {
+    'small-full-100x3'          : lambda: popular(100, 3, 3, True, 1),
+    'partial-10k-x10'           : lambda: popular(10_000, 10, 10, False, 2),
+    'full-10k-x200'             : lambda: popular(10_000, 200, 200, True, 3),
+    'partial-100k-x50'          : lambda: popular(100_000, 50, 8, False, 4),
+    'partial-100k-x200'         : lambda: popular(100_000, 200, 10, False, 5),
+    'full-1m-x5'                : lambda: popular(1_000_000, 5, 5, True, 6),
+    'partial-1m-x20'            : lambda: popular(1_000_000, 20, 6, False, 7),
+    'tie-10k-x200'              : lambda: ties(10_000, 200, 8),
+    'tie-1m-x10'                : lambda: ties(1_000_000, 10, 9),
+    'exhaust-10k-x200'          : lambda: exhausting(10_000, 200, 10),
+    'exhaust-100k-x200'         : lambda: exhausting(100_000, 200, 11),
+}
+
+# Cases left out of a --quick run
+SLOW = ['full-1m-x5', 'partial-1m-x20', 'tie-1m-x10']
+
+def peakRSS():
+    '''Returns the peak resident memory of this process in MB
+    NOTE: On Linux ru_maxrss keeps the parent's peak from before the fork, so VmHWM is read instead -- it starts over at exec.
+          Elsewhere ru_maxrss is used, in kilobytes on Linux and bytes on macOS.'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def count(path, repeat):
+    '''Times the count of a saved election and measures its memory -- runs in a process of its own'''
+    df = pl.read_ipc(path)
+    loaded = peakRSS()
+
+    # Best of a few runs
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = rankChoice(df)
+        best = min(best, time.perf_counter() - start)
+    peak = peakRSS()
+
+    # One more run for tracemalloc -- tracing slows things down and adds memory of its own
+    tracemalloc.start()
+    rankChoice(df)
+    _, traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ballots'       : df['name'].n_unique(),
+        'rows'          : len(df),
+        'rounds'        : len(result.rounds),
+        'tieBreak'      : '/'.join(result.tieBreak),
+        'seconds'       : best,
+        'roundsPerSec'  : len(result.rounds) / best,
+        'peakMB'        : peak,
+        'countMB'       : peak - loaded,
+        'tracedMB'      : traced / 2**20
+    }
+
+def measure(df, repeat):
+    '''Counts an election in a fresh process and returns its timing and memory
+    NOTE: The ballots are handed over in an Arrow file, so building them doesn't show up in the peak'''
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'ballots.arrow')
+        df.write_ipc(path)
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--count', path, '--repeat', str(repeat)],
+            check = True, capture_output = True, text = True
+        )
+    return json.loads(out.stdout)
+
+def report(name, stats, baseline):
+    '''Prints one line for a case, with the change against the baseline if there is one'''
+    line = (
+        f"{name:<22} {stats['ballots']:>9,} ballots {stats['rounds']:>4} rounds "
+        f"{stats['seconds'] * 1000:>9.1f} ms {stats['roundsPerSec']:>9.1f} rounds/s "
+        f"{stats['peakMB']:>8.1f} MB peak {stats['countMB']:>7.1f} MB counting "
+        f"{stats['tracedMB']:>7.1f} MB traced {stats['tieBreak']}"
+    )
+
+    # Compare against the stored numbers
+    regressed = False
+    if name in baseline:
+        ratio = stats['seconds'] / baseline[name]['seconds']
+        slower = ratio > TOLERANCE
+        line += f'  x{ratio:.2f} time'
+
+        # Baselines saved before memory was measured per process have no countMB
+        bigger = False
+        if 'countMB' in baseline[name]:
+            memory = stats['countMB'] - baseline[name]['countMB']
+            bigger = memory > SLACK_MB and stats['countMB'] > TOLERANCE * baseline[name]['countMB']
+            line += f' {memory:+.1f} MB'
+
+        regressed = slower or bigger
+        line += ' vs baseline' + '  REGRESSION' * slower + '  MEMORY REGRESSION' * bigger
+
+    print(line)
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the ranked choice engine')
+    parser.add_argument('--case', default = '', help = 'only run cases with this in the name')
+    parser.add_argument('--quick', action = 'store_true', help = 'skip the million ballot cases')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'timed runs per case')
+    parser.add_argument('--baseline', default = BASELINE, help = 'baseline file')
+    parser.add_argument('--save', action = 'store_true', help = 'save this run as the baseline')
+    parser.add_argument('--count', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Inside the process measure() starts for one case
+    if args.count:
+        print(json.dumps(count(args.count, args.repeat)))
+        return
+
+    # Read the baseline, if we have one
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    elif not args.save:
+        print(f'No baseline at {args.baseline} yet -- run with --save to store one')
+
+    results = {}
+    regressions = []
+    for name, build in CASES.items():
+        if args.case not in name or (args.quick and name in SLOW):
+            continue
+
+        results[name] = measure(build(), args.repeat)
+        if report(name, results[name], baseline):
+            regressions.append(name)
+
+    # Store the run as the new baseline, keeping any cases we didn't run
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent = 4)
+        print(f'Saved baseline to {args.baseline}')
+
+    # Fail if anything got slower or bigger
+    elif regressions:
+        print(f"Regressed against the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
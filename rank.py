@@ -2,10 +2,17 @@
 Purpose: Simple voting app to implement ranked choice voting.
 '''
 
+import os
 import streamlit as st
 import polars as pl
 import altair as alt
 
+# Custom Modules
+from rankEngine import rankChoice
+from voteMethods import METHODS, count
+from voteLog import voteLog
+from voteStore import voteStore
+
 def main():
     # Defaults
     if 'debug' not in st.session_state:
@@ -16,7 +23,7 @@ def main():
         st.write(st.session_state)
     
     # Init books
-    books, votes = init()
+    store = init()
 
     col1, col2 = st.columns(2)
 
@@ -37,10 +44,10 @@ def main():
             st.button("Heck yes", key = 'yes')
             st.button("No")
 
-        # If we have an answer and the answer for yes == True, reset the cache
+        # If we have an answer and the answer for yes == True, reset the books and votes
         if 'yes' in st.session_state and st.session_state['yes'] == True:
-            # Clear cache
-            st.cache_resource.clear()
+            # Clear the store -- the reset goes in the log like everything else
+            store.reset()
             st.rerun()
 
     # Set the value of book equal to the input data
@@ -54,12 +61,11 @@ def main():
     st.text_input("Add a book to the voting arena", key = 'book').strip()
     if book:
         # Add the result if it's not in our data already
-        if book not in books:
-            books.append(book)
+        if store.addBook(book):
             st.success(f"Added book: {book}")
 
-    # Sort the books, because we're not heathens
-    books.sort()
+    # Sorted books, because we're not heathens
+    books = store.books.sorted()
     
     # Remove a book -- removing whitespace
     with st.form("remove book"):
@@ -68,9 +74,8 @@ def main():
     
     # If we submitted a book to be removed, remove it
     if removeBook:
-        if remove in books:
+        if remove and store.removeBook(remove):
             st.warning(f'Removing book: {remove}')
-            books.remove(remove)
             st.rerun()
     
     # Debug: Check the current books list and what's been added or removed
@@ -129,7 +134,7 @@ def main():
         st.session_state['user vote'] = currentVote
         st.write("## Your Vote:")
         st.write(currentVote)
-        votes.append(currentVote)
+        st.session_state['user ballot'] = store.addVote(currentVote)
 
     # If the user made a mistake...
     if 'voted' not in st.session_state:
@@ -143,15 +148,14 @@ def main():
         # If the user presses the oops button
         if st.session_state['oops']:
             # Try to remove the vote
-            try:
-                n = votes.index(st.session_state['user vote'])
-                votes.pop(n)
+            if store.removeVote(st.session_state['user ballot']):
                 st.session_state['voted'] = False
                 st.session_state['user vote'] = None
+                st.session_state['user ballot'] = None
                 st.rerun()
             
             # Or report a message that it was not able to be removed
-            except:
+            else:
                 st.error("Your vote could not be undone...")
 
     # Init admin mode
@@ -178,7 +182,6 @@ def main():
         st.info("With great power, comes great responsibility")
 
         # Display a gif from a file
-        import os
         path = os.path.join(os.getcwd(), 'desperate-thor.gif')
         st.image(path)
 
@@ -187,212 +190,207 @@ def main():
         # st.markdown(f'<img src={src}/>', unsafe_allow_html=True)
         
         st.write("# All Votes")
-        st.write(votes)
-        n = len(votes)
+        st.write(store.ballots())
 
         # Remove a vote
         with st.form('remove vote'):
-            errantVote = st.selectbox("Remove vote", options = range(n))
+            errantVote = st.selectbox("Remove vote", options = store.ballotIds())
             removeVote = st.form_submit_button("Remove it!")
 
         if removeVote:
-            votes.pop(errantVote)
+            store.removeVote(errantVote)
             st.rerun()
 
 
 
 
     # Display the current number of votes
-    st.write(f"# Number of Votes: {len(votes)}")
+    st.write(f"# Number of Votes: {store.nBallots}")
     st.write('Use the "Refresh" button or refresh the page to see the results as they come in.')
     st.write('NOTE: When you refresh the page, the vote you casted will no longer be displayed.')
 
-    # Convert the votes to a dataframe
-    data = {
-        'name'  : [],
-        'book'  : [],
-        'rank'  : []
-    }
-
-    n = 0
-    for vote in votes:
-        n += 1
-        user = f'user_{n}'
-        for  key, value in vote.items():
-            # Skip 0 votes
-            if value == 0:
-                continue
-            data['name'].append(user)
-            data['book'].append(key)
-            data['rank'].append(value)
-
-    df = pl.DataFrame(data)
+    # Pick how to count the votes
+    col1, col2 = st.columns(2)
+    with col1:
+        method = st.selectbox('Counting method', options = list(METHODS))
+        batch = st.checkbox('Drop every book that can no longer win at once',
+                            help = 'Fewer rounds with lots of books -- the winner is the same',
+                            disabled = method != 'Instant runoff')
+    with col2:
+        seats = st.number_input('Books to pick', min_value = 1, value = 2,
+                                disabled = method != 'Single transferable vote')
+
+    # Count the votes -- reruns with the same ballots reuse the last count
+    result, chart = electionResults(store.fingerprint(), method, seats, batch, store)
 
     # If we don't have data, don't score
-    if len(df) == 0:
+    if result is None:
         return
-    
-    # Otherwise run the voting algo
-    rankChoice(df)
+
+    # Otherwise show the results
+    showResults(result, chart)
 
 
 @st.cache_resource()
 def init():
-    '''Initializes global variables'''
-    books = []
-    votes = []
-    return books, votes
-
-### Copied functions
-def rankChoice(df, round = 1, scale = None):
-    '''Run the ranked choice algorithm'''
-    # Keep track of the rounds
-    results = {}
-
-    # Find the highest ranked vote for each person
-    for name in df['name'].unique().to_list():
-        subset = df.filter(pl.col('name') == name)
-        lowestRank = float('inf')
-        book = None
-
-        # Just look at the results for that person
-        for n in range(len(subset)):
-            rank = subset['rank'][n]
-
-            # The lower a rank value is, the higher the value of the choice
-            if rank != None and rank < lowestRank:
-                lowestRank = rank
-                book = subset['book'][n]
+    '''Initializes global variables
+    NOTE: Books and ballots are logged to the data folder (or $BOOK_CLUB_DATA) and reloaded on a restart'''
+    folder = os.environ.get('BOOK_CLUB_DATA', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    return voteStore(voteLog(folder))
 
-        
-        # If we got a book, add it to our results
-        if book:
-            if book not in results:
-                results[book] = 1
-            else:
-                results[book] += 1
-
-    # Convert the results to a dataframe
-    r = {
-        'book'  : [],
-        'votes' : []
-    }
-    for book in results:
-        r['book'].append(book)
-        r['votes'].append(results[book])
-
-    # Add any books that didn't get votes back in
-    for book in df['book'].unique().to_list():
-        if book not in r['book']:
-            r['book'].append(book)
-            r['votes'].append(0)
-
-    # Convert the round results to a dataframe
-    r = pl.DataFrame(r)
-
-    # Add the percentage to the dataframe
-    r = r.with_columns(
-        (pl.col('votes') / r['votes'].sum()).alias('percent')
-    )
+@st.cache_resource(max_entries = 16, show_spinner = False)
+def electionResults(fingerprint, method, seats, batch, _store):
+    '''Runs the voting algo and builds the chart once per set of ballots'''
+    df, firstRound = _store.snapshot()
 
-    # Sort the results by vote
-    r = r.sort(by = 'votes', descending = True)
+    # If we don't have data, don't score
+    if len(df) == 0:
+        return None, None
 
-    # Set the scale
-    if scale == None:
-        scale = alt.Scale(domain = sorted(r['book'].unique().to_list()))
+    # The store keeps the first round counted as ballots come in
+    if method == 'Instant runoff':
+        result = rankChoice(df, firstRound, batch)
+    else:
+        result = count(df, method, seats)
+    return result, resultsChart(result)
 
-    # Plot the results
-    chart = alt.Chart(r.to_pandas()).mark_bar().encode(
+def resultsChart(result):
+    '''Plots every round of an election at once, one panel per round'''
+    return alt.Chart(result.roundsFrame().to_pandas()).mark_bar().encode(
         x = 'book',
         y = 'votes',
-        color = alt.Color('book', scale = scale),
+        color = alt.Color('book', scale = alt.Scale(domain = result.books)),
         tooltip = [
             'book',
             'votes',
             alt.Tooltip('percent', format = '.1%')
         ]
-    )
-    chart.title = f'Round {round} results'
+    ).facet(
+        alt.Facet('round:O', title = 'Round results'),
+        columns = 3
+    ).resolve_scale(x = 'independent')
 
+def showResults(result, chart):
+    '''Draws the rounds and announces the winner of an election'''
     # Show the chart
     st.altair_chart(chart)
 
-    # Check if the top result got more than 50% of the vote
-    top = r['votes'].max() / r['votes'].sum()
-    
-    # If the top result has more than 50% of the vote, we have a winner
-    if top > .5:
-        highest = r.filter(pl.col('votes') == r['votes'].max())
-        st.write("# The winning book is:")
-        st.write(f"## {highest['book'][0]}!!!")
-    
-    else:
-        # Endless loop catch
-        if round > 100:
-            st.error("More than 100 rounds have passed without a victor...")
-            return
-        
-        # Get the lowest result(s)
-        lowest = r.filter(pl.col('votes') == r['votes'].min())
-        lowestBooks = lowest['book'].unique().to_list()
-
-        # Remove the results (the one's that don't have the lowest votes)
-        dfUpdate = df.filter(pl.col('book').is_in(lowestBooks) == False)
-
-        # If the new dataframe has a length of 0, we have an issue
-        if len(dfUpdate) == 0:
-            # Warn the user
-            st.warning("No clear winner, trying a tie break")
-
-            # Try to sum the rank of each remaining candidate
-            dfUpdate = df.group_by('book').agg(pl.col('rank').mean())
-
-            # We want to find the item that has the lowest average rank score
-            highest = dfUpdate.filter(
-                pl.col('rank') == dfUpdate['rank'].min()
-            )
-
-            # If we have a winner now...
-            if len(highest) == 1:
-                st.write('# The winning book is:')
-                st.write(f"## {highest['book'][0]}!")
-                return
-            
-            # If there still isn't a winner, randomly select between the options
-            st.error('The tie break method did not work...')
-            import random
+    # List the rounds that dropped several steps' worth of books at once
+    for n, steps in enumerate(result.steps):
+        if len(steps) > 1:
+            st.caption(f"After round {n + 1}, eliminated in turn: {' → '.join(', '.join(step) for step in steps)}")
 
-            # Combine the remaining books into a single string
-            string = ''
-            books = sorted(dfUpdate['book'].unique().to_list())
-            for item in books:
-                string += item
+    # If no one had a majority, explain how the tie was broken
+    if 'mean rank' in result.tieBreak:
+        st.warning("No clear winner, trying a tie break")
 
-            # Convert the string to a number
-            randomSeed = string_to_int_custom(string)
+    if result.winner is None:
+        st.write(f"# No winner by {result.method}")
 
-            # Use this as the random seed
-            random.seed(randomSeed)
+    elif len(result.winners) > 1:
+        st.write("# The winning books are:")
+        for book in result.winners:
+            st.write(f"## {book}!!!")
 
-            # Randomly select one of the remaining books
-            book = books[random.randint(0, len(books) - 1)]
+    elif 'random' in result.tieBreak:
+        st.error('The tie break method did not work...')
+        st.write("# Randomly selected from the remaining books...")
+        st.write(f'## {result.winner} is the winner!')
 
-            st.write("# Randomly selected from the remaining books...")
-            st.write(f'## {book} is the winner!')
-            return
+    elif 'mean rank' in result.tieBreak:
+        st.write('# The winning book is:')
+        st.write(f"## {result.winner}!")
 
-        # Run the algorithm again
-        rankChoice(dfUpdate, round + 1, scale)
+    else:
+        st.write("# The winning book is:")
+        st.write(f"## {result.winner}!!!")
+
+def scanBallots(path):
+    '''Lazily reads a name/book/rank ballot file -- CSV, Parquet or Arrow IPC'''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        lf = pl.scan_csv(path)
+    elif extension in ['.parquet', '.pq']:
+        lf = pl.scan_parquet(path)
+    elif extension in ['.arrow', '.ipc', '.feather']:
+        lf = pl.scan_ipc(path)
+    else:
+        raise ValueError(f'Unknown ballot file type: {path}')
 
-def string_to_int_custom(s):
-    # Create a mapping of each character to a unique number
-    char_to_num = {char: idx for idx, char in enumerate(sorted(set(s)))}
-    # Convert the string to a number based on the mapping
-    num = 0
-    for char in s:
-        num = num * 100 + char_to_num[char]  # Use a base large enough to avoid collisions
-    return num
+    # Only the ranked entries count -- skip 0 votes
+    return lf.select('name', 'book', 'rank').filter(
+        pl.col('rank').is_not_null(),
+        pl.col('rank') != 0
+    )
+
+def printResults(result):
+    '''Prints the rounds and the winner of an election'''
+    print(result.method)
+    for n, r in enumerate(result.rounds):
+        print(f'Round {n + 1} results')
+        print(r)
+
+        # Note what dropped out after the round
+        if n < len(result.steps) and len(result.steps[n]) > 1:
+            print(f"Eliminated in turn: {' -> '.join(', '.join(step) for step in result.steps[n])}")
+        elif n < len(result.eliminated) and result.eliminated[n]:
+            print(f"Eliminated: {', '.join(result.eliminated[n])}")
+        print()
+
+    # If no one had a majority, explain how the tie was broken
+    if 'mean rank' in result.tieBreak:
+        print('No clear winner, trying a tie break')
+
+    if result.winner is None:
+        print(f'No winner by {result.method}')
+    elif len(result.winners) > 1:
+        print(f"The winning books are: {', '.join(result.winners)}")
+    elif 'random' in result.tieBreak:
+        print('The tie break method did not work...')
+        print('Randomly selected from the remaining books...')
+        print(f'{result.winner} is the winner!')
+    else:
+        print(f'The winning book is: {result.winner}')
+
+def cli():
+    '''Counts a ballot file from the command line'''
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Count a name/book/rank ballot file with ranked choice voting')
+    parser.add_argument('ballots', help = 'CSV, Parquet or Arrow IPC file of name/book/rank rows')
+    parser.add_argument('--rounds', help = 'write the round by round results to this Parquet file')
+    parser.add_argument('--method', default = 'Instant runoff', choices = list(METHODS), help = 'how to count the votes')
+    parser.add_argument('--seats', type = int, default = 2, help = 'books to pick with the single transferable vote')
+    parser.add_argument('--batch', action = 'store_true', help = 'drop every book that can no longer win at once')
+    parser.add_argument(
+        '--in-memory', action = 'store_true',
+        help = 'load the ballots once instead of re-scanning the file every round -- faster, if the file fits in memory. '
+               'Methods other than instant runoff always load the whole file.'
+    )
+    args = parser.parse_args()
+
+    # Only the three ballot columns are ever read, in streaming batches
+    lf = scanBallots(args.ballots)
+    if len(lf.head(1).collect(engine = 'streaming')) == 0:
+        print('No ballots to count')
+        return
+
+    # Instant runoff counts every round straight from the file, so memory stays flat however big it is
+    # NOTE: The other methods need every ballot at once
+    if args.method != 'Instant runoff':
+        result = count(lf.collect(engine = 'streaming'), args.method, args.seats)
+    elif args.in_memory:
+        result = rankChoice(lf.collect(engine = 'streaming'), batch = args.batch)
+    else:
+        result = rankChoice(lf, batch = args.batch)
+    printResults(result)
+
+    # Save the rounds for the audit trail
+    if args.rounds:
+        result.roundsFrame().write_parquet(args.rounds)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Under `streamlit run` we draw the page, otherwise we're on the command line
+    if st.runtime.exists():
+        main()
+    else:
+        cli()
\ No newline at end of file
@@ -0,0 +1,325 @@
+'''
+Purpose: Array backed engine for counting ranked choice ballots.
+'''
+
+import numpy as np
+import polars as pl
+
+class ballotMatrix:
+    '''Encodes the name/book/rank ballots once as an integer voter x preference matrix'''
+
+    def __init__(self, df):
+        '''Build the matrix from a name/book/rank dataframe'''
+        # Keep the original data around for the tie break
+        self.df = df
+
+        # Every book gets an integer id, in sorted order
+        self.books = sorted(df['book'].drop_nulls().unique().to_list())
+
+        # Only ranked entries make it onto a ballot
+        ranked = df.filter(
+            pl.col('name').is_not_null(),
+            pl.col('book').is_not_null(),
+            pl.col('rank').is_not_null()
+        )
+
+        # Number the voters, look up the book ids, and order each ballot by preference
+        ranked = ranked.select(
+            (pl.col('name').rank('dense') - 1).cast(pl.Int64).alias('voter'),
+            pl.col('book').cast(pl.Enum(self.books)).to_physical().cast(pl.Int32).alias('book'),
+            pl.col('rank')
+        ).sort(['voter', 'rank'], maintain_order = True)
+
+        # The position of each book on the voter's ballot (0 is their top choice)
+        ranked = ranked.with_columns(
+            pl.int_range(pl.len()).over('voter').alias('position')
+        )
+
+        # Fill the matrix -- empty slots at the end of a ballot are -1
+        nVoters = ranked['voter'].max() + 1 if len(ranked) else 0
+        width = ranked['position'].max() + 1 if len(ranked) else 0
+        self.prefs = np.full((nVoters, width), -1, dtype = np.int32)
+        self.prefs[ranked['voter'].to_numpy(), ranked['position'].to_numpy()] = ranked['book'].to_numpy()
+
+def roundFrame(books, votes, dtype = pl.Int64):
+    '''Returns the votes for each book as a book/votes/percent dataframe
+    NOTE: Pass dtype = pl.Float64 for fractional votes or scores'''
+    r = pl.DataFrame({
+        'book'  : books,
+        'votes' : votes
+    }, schema = {'book' : pl.String, 'votes' : dtype})
+
+    # Add the percentage to the dataframe
+    r = r.with_columns(
+        (pl.col('votes') / r['votes'].sum()).alias('percent')
+    )
+
+    # Sort the results by vote
+    return r.sort(by = 'votes', descending = True)
+
+class instantRunoff:
+    '''Keeps the state of an instant runoff between rounds'''
+
+    def __init__(self, ballots):
+        '''Start every ballot on its top choice with every book still in the running'''
+        self.ballots = ballots
+        self.books = ballots.books
+        self.ids = {book: n for n, book in enumerate(self.books)}
+        prefs = ballots.prefs
+
+        # Books that haven't been eliminated yet
+        self.active = np.ones(len(self.books), dtype = bool)
+
+        # Where each ballot is pointing and the book it currently counts for
+        self.pointer = np.zeros(len(prefs), dtype = np.int64)
+        if prefs.shape[1]:
+            self.choice = prefs[:, 0].copy()
+        else:
+            self.choice = np.full(len(prefs), -1, dtype = np.int32)
+
+    def tally(self):
+        '''Returns the number of ballots counting for each book id'''
+        return np.bincount(self.choice[self.choice >= 0], minlength = len(self.books))
+
+    def results(self):
+        '''Returns the current round as a book/votes/percent dataframe'''
+        ids = np.flatnonzero(self.active)
+        return roundFrame(
+            [self.books[i] for i in ids],
+            self.tally()[ids].astype(np.int64)
+        )
+
+    def remaining(self):
+        '''Returns the books still in the running'''
+        return [self.books[i] for i in np.flatnonzero(self.active)]
+
+    def eliminate(self, books):
+        '''Removes the given books and moves their ballots on to the next choice'''
+        ids = np.array([self.ids[book] for book in books], dtype = np.int32)
+        self.active[ids] = False
+
+        # Only the ballots sitting on an eliminated book need to move
+        moved = np.flatnonzero(np.isin(self.choice, ids))
+        prefs = self.ballots.prefs
+        width = prefs.shape[1]
+
+        # Step forward until every moved ballot lands on an active book or runs out
+        while len(moved):
+            self.pointer[moved] += 1
+            step = np.full(len(moved), -1, dtype = np.int32)
+            left = self.pointer[moved] < width
+            step[left] = prefs[moved[left], self.pointer[moved[left]]]
+            self.choice[moved] = step
+
+            # Ballots that landed on another eliminated book keep going
+            moved = moved[(step >= 0) & ~self.active[np.maximum(step, 0)]]
+
+    def meanRanks(self):
+        '''Returns the average rank of each remaining book'''
+        df = self.ballots.df
+        return df.filter(
+            pl.col('book').is_in(self.remaining())
+        ).group_by('book').agg(pl.col('rank').mean())
+
+class lazyRunoff:
+    '''Runs an instant runoff as one lazy query per round, so the ballots never have to fit in memory
+    NOTE: Only the book names are ever pulled into Python'''
+
+    def __init__(self, lf):
+        '''Start with every book still in the running'''
+        self.lf = lf
+
+        # Every book that was on a ballot
+        self.books = sorted(
+            lf.select(pl.col('book').drop_nulls().unique())
+            .collect(engine = 'streaming')['book'].to_list()
+        )
+
+        # Books that haven't been eliminated yet
+        self.active = set(self.books)
+
+    def results(self):
+        '''Returns the current round as a book/votes/percent dataframe'''
+        remaining = self.remaining()
+
+        # Each voter's highest ranked book that's still in the running
+        counts = (
+            self.lf.filter(
+                pl.col('book').is_in(remaining),
+                pl.col('rank').is_not_null()
+            )
+            .group_by('name')
+            .agg(pl.col('book').get(pl.col('rank').arg_min()))
+            .group_by('book')
+            .agg(pl.len().alias('votes'))
+            .collect(engine = 'streaming')
+        )
+        counts = dict(zip(counts['book'].to_list(), counts['votes'].to_list()))
+
+        # Books that didn't get votes still show up with 0
+        return roundFrame(remaining, [counts.get(book, 0) for book in remaining])
+
+    def remaining(self):
+        '''Returns the books still in the running'''
+        return [book for book in self.books if book in self.active]
+
+    def eliminate(self, books):
+        '''Removes the given books -- the next round's query skips them'''
+        self.active -= set(books)
+
+    def meanRanks(self):
+        '''Returns the average rank of each remaining book'''
+        return self.lf.filter(
+            pl.col('book').is_in(self.remaining())
+        ).group_by('book').agg(pl.col('rank').mean()).collect(engine = 'streaming')
+
+class electionResult:
+    '''The outcome of an election: every round, what was eliminated, and the winner'''
+
+    def __init__(self, books, method = 'Instant runoff'):
+        # Every book that was on a ballot
+        self.books = books
+
+        # How the ballots were counted
+        self.method = method
+
+        # book/votes/percent dataframe for each round
+        self.rounds = []
+
+        # Books removed after each round
+        self.eliminated = []
+
+        # The same books split into the one-at-a-time steps they stand for, lowest first
+        # NOTE: Only batch elimination drops more than one step per round
+        self.steps = []
+
+        # Head to head counts, for the methods that use them
+        self.pairwise = None
+
+        # Tie break steps that were needed -- 'mean rank' and then 'random'
+        self.tieBreak = []
+
+        # The winning book -- methods that fill several seats list them all in winners
+        self.winner = None
+        self.winners = []
+
+    def declare(self, winners):
+        '''Records the winning book(s)'''
+        self.winners = list(winners)
+        self.winner = self.winners[0] if self.winners else None
+        return self
+
+    def roundsFrame(self):
+        '''Returns all the rounds stacked into one dataframe with a round column'''
+        return pl.concat([
+            r.with_columns(pl.lit(n + 1).alias('round'))
+            for n, r in enumerate(self.rounds)
+        ])
+
+def defeated(r):
+    '''Returns the groups of tied books at the bottom of a round that can never win, lowest first
+    NOTE: A book is beaten for good when it and everything below it have fewer votes than the next book up,
+          since even all of their ballots moving to one of them couldn't catch it'''
+    ordered = r.sort('votes')
+    books = ordered['book'].to_list()
+    votes = ordered['votes'].to_list()
+
+    # Find the deepest cut that's safe to make
+    total = 0
+    cut = 0
+    for n in range(len(votes) - 1):
+        total += votes[n]
+        if total < votes[n + 1]:
+            cut = n + 1
+
+    # Split what's below the cut into groups of tied books
+    groups = []
+    for n in range(cut):
+        if n == 0 or votes[n] != votes[n - 1]:
+            groups.append([])
+        groups[-1].append(books[n])
+    return [sorted(group) for group in groups]
+
+def rankChoice(df, firstRound = None, batch = False):
+    '''Run the ranked choice algorithm and return the electionResult
+    NOTE: df can be a LazyFrame, in which case each round runs on the streaming engine
+    NOTE: firstRound can hand over an already counted first round
+    NOTE: With batch = True every book that can't win any more is dropped at once, instead of just the lowest'''
+    # Encode the ballots once and start the runoff
+    if isinstance(df, pl.LazyFrame):
+        runoff = lazyRunoff(df)
+    else:
+        runoff = instantRunoff(ballotMatrix(df))
+    result = electionResult(runoff.books)
+
+    # Run rounds until we have a winner -- every round removes at least one book
+    while True:
+        if firstRound is not None and not result.rounds:
+            r = firstRound
+        else:
+            r = runoff.results()
+        result.rounds.append(r)
+
+        # Check if the top result got more than 50% of the vote
+        top = r['votes'].max() / r['votes'].sum()
+
+        # If the top result has more than 50% of the vote, we have a winner
+        if top > .5:
+            highest = r.filter(pl.col('votes') == r['votes'].max())
+            return result.declare([highest['book'][0]])
+
+        # Get the lowest result(s)
+        lowest = r.filter(pl.col('votes') == r['votes'].min())
+        lowestBooks = lowest['book'].unique().to_list()
+
+        # If removing the lowest results would leave nothing, break the tie
+        if len(lowestBooks) == len(r):
+            return result.declare([tieBreak(runoff.meanRanks(), result.tieBreak)])
+
+        # In batch mode, also take out everything else that's already beaten
+        steps = [sorted(lowestBooks)]
+        if batch:
+            steps = defeated(r) or steps
+            lowestBooks = [book for step in steps for book in step]
+
+        # Remove the lowest results and move their ballots on to the next choice
+        result.eliminated.append(sorted(lowestBooks))
+        result.steps.append(steps)
+        runoff.eliminate(lowestBooks)
+
+def tieBreak(ranks, path):
+    '''Picks a winner from a book/rank dataframe of average ranks, noting each step in path'''
+    # We want to find the item that has the lowest average rank score
+    path.append('mean rank')
+    highest = ranks.filter(
+        pl.col('rank') == ranks['rank'].min()
+    )
+
+    # If we have a winner now...
+    if len(highest) == 1:
+        return highest['book'][0]
+
+    # If there still isn't a winner, randomly select between the options
+    path.append('random')
+    import random
+
+    # Combine the remaining books into a single string
+    string = ''
+    books = sorted(ranks['book'].unique().to_list())
+    for item in books:
+        string += item
+
+    # Convert the string to a number and use it as the random seed
+    random.seed(string_to_int_custom(string))
+
+    # Randomly select one of the remaining books
+    return books[random.randint(0, len(books) - 1)]
+
+def string_to_int_custom(s):
+    # Create a mapping of each character to a unique number
+    char_to_num = {char: idx for idx, char in enumerate(sorted(set(s)))}
+    # Convert the string to a number based on the mapping
+    num = 0
+    for char in s:
+        num = num * 100 + char_to_num[char]  # Use a base large enough to avoid collisions
+    return num
@@ -0,0 +1,159 @@
+'''
+Purpose: Append-only on-disk log of the book and ballot events, so the votes survive a restart.
+
+Layout of the data folder:
+    votes-<first seq>.log       one JSON event per line, numbered by seq
+    snapshot.npz                the whole store as of some seq
+    history/                    older log files, kept as the audit trail
+
+Replaying the snapshot and then the events after it gives back the store.
+Every few thousand events a new snapshot is written and the log files it covers are moved to history,
+so a restart only ever reads one snapshot and a short tail of events.
+'''
+
+import glob
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+class voteLog:
+    '''Write-ahead log of voteStore events with group commit and periodic snapshots'''
+
+    def __init__(self, folder, snapshotEvery = 2000):
+        self.folder = folder
+        self.snapshotEvery = snapshotEvery
+        os.makedirs(os.path.join(folder, 'history'), exist_ok = True)
+
+        # Guards the file and the seq counter
+        self.lock = threading.Lock()
+
+        # Only one fsync at a time -- whoever waits behind it usually finds their event already synced
+        self.syncLock = threading.Lock()
+
+        self.seq = 0            # last event written
+        self.synced = 0         # last event known to be on disk
+        self.snapshotSeq = 0    # last event covered by the snapshot
+        self.file = None
+
+    def segments(self):
+        '''Returns the log files, oldest first'''
+        return sorted(glob.glob(os.path.join(self.folder, 'votes-*.log')))
+
+    def load(self):
+        '''Returns the latest snapshot (or None) and the events logged after it
+        NOTE: Also opens a fresh log file for the events to come'''
+        state = None
+        path = os.path.join(self.folder, 'snapshot.npz')
+        if os.path.exists(path):
+            with np.load(path, allow_pickle = False) as f:
+                state = {key: f[key] for key in f.files}
+            state['meta'] = json.loads(str(state['meta']))
+            self.snapshotSeq = state['meta']['seq']
+
+        # Only the events the snapshot doesn't cover yet
+        events = []
+        self.seq = self.snapshotSeq
+        for segment in self.segments():
+            for event in self.read(segment):
+                if event['seq'] > self.snapshotSeq:
+                    events.append(event)
+                    self.seq = event['seq']
+
+        self.synced = self.seq
+        self.rotate()
+        return state, events
+
+    def read(self, segment):
+        '''Returns the events in a log file
+        NOTE: A crash can leave half a line at the end of the file. It's cut off, so the next event
+              doesn't get written onto the end of it -- anywhere else a bad line is an error.'''
+        events = []
+        good = 0        # bytes up to the end of the last whole line
+        with open(segment, 'rb') as f:
+            lines = f.readlines()
+        for n, line in enumerate(lines):
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('no newline')
+                events.append(json.loads(line))
+            except ValueError:
+                if n < len(lines) - 1:
+                    raise ValueError(f'{segment} has a bad line {n + 1} with events after it')
+                log.warning('Cutting a half written event off the end of %s: %r', segment, line[:200])
+                with open(segment, 'r+b') as f:
+                    f.truncate(good)
+                    f.flush()
+                    os.fsync(f.fileno())
+                break
+            good += len(line)
+        return events
+
+    def rotate(self):
+        '''Starts a new log file for the events after the current seq'''
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.folder, f'votes-{self.seq + 1:012d}.log')
+        self.file = open(path, 'a', encoding = 'utf-8')
+
+    def append(self, event):
+        '''Writes an event to the log and returns its seq
+        NOTE: The event isn't durable until commit(seq) returns'''
+        with self.lock:
+            self.seq += 1
+            self.file.write(json.dumps({'seq': self.seq, **event}) + '\n')
+            return self.seq
+
+    def commit(self, seq):
+        '''Waits until the event with the given seq is on disk
+        NOTE: One fsync covers every event written before it, so sessions voting at once share it'''
+        with self.syncLock:
+            if self.synced >= seq:
+                return
+
+            with self.lock:
+                self.file.flush()
+                upTo = self.seq
+                fileno = self.file.fileno()
+            os.fsync(fileno)
+            self.synced = max(self.synced, upTo)
+
+    def due(self):
+        '''Checks if it's time for a new snapshot'''
+        return self.seq - self.snapshotSeq >= self.snapshotEvery
+
+    def snapshot(self, state):
+        '''Saves the whole store as of the current seq and moves the log files it covers to history
+        NOTE: The caller must hold the store lock so nothing is logged in the meantime'''
+        with self.syncLock, self.lock:
+            # Make sure every event so far is on disk, then start a new log file
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.synced = self.seq
+            old = self.segments()
+            self.rotate()
+
+            # Write the snapshot next to the old one and swap it in
+            path = os.path.join(self.folder, 'snapshot.npz')
+            temp = path + '.tmp'
+            meta = np.array(json.dumps({**state.pop('meta'), 'seq': self.seq}))
+            with open(temp, 'wb') as f:
+                np.savez(f, meta = meta, **state)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, path)
+            self.snapshotSeq = self.seq
+
+            # The snapshot has everything in the old log files now
+            for segment in old:
+                os.replace(segment, os.path.join(self.folder, 'history', os.path.basename(segment)))
+
+    def close(self):
+        '''Syncs and closes the log file'''
+        self.commit(self.seq)
+        with self.lock:
+            self.file.close()
+            self.file = None
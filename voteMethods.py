@@ -0,0 +1,202 @@
+'''
+Purpose: Other ways of counting the same ranked ballots -- Borda, Condorcet, Schulze and multi-winner STV.
+
+Every method takes the name/book/rank dataframe used by rankChoice and returns an electionResult.
+Borda, Condorcet and Schulze all work off one pairwise preference matrix.
+'''
+
+import numpy as np
+import polars as pl
+
+# Custom Modules
+from rankEngine import ballotMatrix, electionResult, instantRunoff, rankChoice, roundFrame, tieBreak
+
+def pairwise(ballots):
+    '''Returns the pairwise preference matrix: P[a, b] is the number of ballots that rank a above b
+    NOTE: A ranked book beats every unranked book on the same ballot'''
+    prefs = ballots.prefs
+    nVoters, width = prefs.shape
+    nBooks = len(ballots.books)
+
+    # Long ballots: compare the position of every pair of books on each ballot
+    if 4 * width * width > nBooks * nBooks:
+        pos = np.full((nVoters, nBooks), width, dtype = np.int16)
+        voters, slots = np.nonzero(prefs >= 0)
+        pos[voters, prefs[voters, slots]] = slots
+
+        # A chunk of ballots at a time, to keep memory flat
+        P = np.zeros((nBooks, nBooks), dtype = np.int64)
+        chunk = max(1, 2**24 // max(1, nBooks * nBooks))
+        for start in range(0, nVoters, chunk):
+            p = pos[start:start + chunk]
+            P += np.count_nonzero(p[:, :, None] < p[:, None, :], axis = 0)
+        return P
+
+    # Short ballots: only visit the pairs of books ranked on the same ballot
+    ordered = np.zeros(nBooks * nBooks, dtype = np.int64)
+    chunk = max(1, 2**22 // max(1, width))
+    for start in range(0, nVoters, chunk):
+        p = prefs[start:start + chunk].astype(np.int64)
+        for i in range(width - 1):
+            above, below = p[:, i:i + 1], p[:, i + 1:]
+            pairs = (above * nBooks + below)[(above >= 0) & (below >= 0)]
+            ordered += np.bincount(pairs, minlength = nBooks * nBooks)
+    ordered = ordered.reshape(nBooks, nBooks)
+
+    # A ballot ranking a puts it above b unless it ranks b higher
+    ranked = np.bincount(prefs[prefs >= 0], minlength = nBooks)
+    P = ranked[:, None] - ordered.T
+    np.fill_diagonal(P, 0)
+    return P
+
+def pairwiseFrame(ballots, P):
+    '''Returns the pairwise matrix as a dataframe with a row and a column for each book'''
+    return pl.DataFrame(P, schema = ballots.books, orient = 'row').insert_column(
+        0, pl.Series('book', ballots.books)
+    )
+
+def meanRanks(ballots, books):
+    '''Returns the average rank of the given books'''
+    return ballots.df.filter(
+        pl.col('book').is_in(books)
+    ).group_by('book').agg(pl.col('rank').mean())
+
+def pickWinner(ballots, result, books):
+    '''Declares the winner out of the tied top books, breaking ties like rankChoice'''
+    if len(books) == 1:
+        return result.declare(books)
+    return result.declare([tieBreak(meanRanks(ballots, books), result.tieBreak)])
+
+def borda(df):
+    '''Borda count: every book scores a point for each book ranked below it'''
+    ballots = ballotMatrix(df)
+    result = electionResult(ballots.books, 'Borda count')
+
+    # With unranked books tied for last, a book's score is its row sum
+    scores = pairwise(ballots).sum(axis = 1)
+    result.rounds.append(roundFrame(ballots.books, scores))
+
+    top = [book for book, score in zip(ballots.books, scores) if score == scores.max()]
+    return pickWinner(ballots, result, top)
+
+def condorcet(df):
+    '''Condorcet winner: the book that beats every other book head to head
+    NOTE: There may not be one, in which case the winner is None'''
+    ballots = ballotMatrix(df)
+    result = electionResult(ballots.books, 'Condorcet')
+    P = pairwise(ballots)
+    result.pairwise = pairwiseFrame(ballots, P)
+
+    # Number of head to head wins for each book
+    wins = (P > P.T).sum(axis = 1)
+    result.rounds.append(roundFrame(ballots.books, wins))
+
+    return result.declare([
+        book for book, n in zip(ballots.books, wins) if n == len(ballots.books) - 1
+    ])
+
+def schulze(df):
+    '''Schulze method: compares the strongest chain of head to head wins between each pair of books'''
+    ballots = ballotMatrix(df)
+    result = electionResult(ballots.books, 'Schulze')
+    P = pairwise(ballots)
+    result.pairwise = pairwiseFrame(ballots, P)
+
+    # Strength of the direct wins
+    strength = np.where(P > P.T, P, 0)
+
+    # Widest paths, Floyd-Warshall style -- one array update per intermediate book
+    for k in range(len(ballots.books)):
+        strength = np.maximum(strength, np.minimum(strength[:, k:k + 1], strength[k:k + 1, :]))
+    np.fill_diagonal(strength, 0)
+
+    # A book wins if no other book has a stronger path against it
+    beats = strength > strength.T
+    result.rounds.append(roundFrame(ballots.books, beats.sum(axis = 1)))
+
+    unbeaten = ~(strength.T > strength).any(axis = 1)
+    return pickWinner(ballots, result, [book for book, ok in zip(ballots.books, unbeaten) if ok])
+
+class singleTransferableVote(instantRunoff):
+    '''Instant runoff with fractional ballots, so surplus votes move on once a book is elected'''
+
+    def __init__(self, ballots):
+        super().__init__(ballots)
+
+        # Every ballot starts out worth one vote
+        self.weight = np.ones(len(ballots.prefs))
+
+    def tally(self):
+        '''Returns the weighted votes counting for each book id'''
+        counting = self.choice >= 0
+        return np.bincount(self.choice[counting], weights = self.weight[counting], minlength = len(self.books))
+
+    def results(self):
+        '''Returns the current round as a book/votes/percent dataframe'''
+        ids = np.flatnonzero(self.active)
+        return roundFrame([self.books[i] for i in ids], self.tally()[ids], pl.Float64)
+
+    def elect(self, book, votes, quota):
+        '''Elects a book and passes the surplus on to the next choice on its ballots'''
+        n = self.ids[book]
+        self.weight[self.choice == n] *= (votes - quota) / votes
+        self.eliminate([book])
+
+def stv(df, seats = 2):
+    '''Single transferable vote with a Droop quota, to pick several books at once'''
+    ballots = ballotMatrix(df)
+    runoff = singleTransferableVote(ballots)
+    result = electionResult(ballots.books, f'Single transferable vote ({seats} seats)')
+    winners = []
+
+    # Votes needed to be elected
+    quota = (runoff.choice >= 0).sum() // (seats + 1) + 1
+
+    while len(winners) < seats:
+        r = runoff.results()
+        result.rounds.append(r)
+
+        # If there are only as many books left as seats, they're all in
+        if len(winners) + len(r) <= seats:
+            winners += r['book'].to_list()
+            break
+
+        # Elect the top book once it reaches the quota
+        if r['votes'][0] >= quota:
+            book = r['book'][0]
+            winners.append(book)
+            result.eliminated.append([])
+            result.steps.append([])
+            runoff.elect(book, r['votes'][0], quota)
+            continue
+
+        # Otherwise drop the lowest book(s)
+        lowestBooks = r.filter(pl.col('votes') == r['votes'].min())['book'].to_list()
+
+        # If that would leave too few books, fill the seats by average rank
+        if len(r) - len(lowestBooks) < seats - len(winners):
+            result.tieBreak.append('mean rank')
+            ranks = meanRanks(ballots, r['book'].to_list()).sort(['rank', 'book'])
+            winners += ranks['book'].to_list()[:seats - len(winners)]
+            break
+
+        result.eliminated.append(sorted(lowestBooks))
+        result.steps.append([sorted(lowestBooks)])
+        runoff.eliminate(lowestBooks)
+
+    return result.declare(winners)
+
+# name -> counting function
+METHODS = {
+    'Instant runoff'            : rankChoice,
+    'Borda count'               : borda,
+    'Condorcet'                 : condorcet,
+    'Schulze'                   : schulze,
+    'Single transferable vote'  : stv,
+}
+
+def count(df, method = 'Instant runoff', seats = 2):
+    '''Counts the ballots with the named method'''
+    if method == 'Single transferable vote':
+        return stv(df, seats)
+    return METHODS[method](df)
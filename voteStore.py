@@ -0,0 +1,378 @@
+'''
+Purpose: Shared book and ballot storage for the rank choice page.
+'''
+
+import threading
+import uuid
+import numpy as np
+import polars as pl
+
+# Custom Modules
+from rankEngine import roundFrame
+
+class bookRegistry:
+    '''Gives every book a stable integer id and keeps track of the ones in the voting arena'''
+
+    def __init__(self):
+        self.titles = []        # id -> book
+        self.ids = {}           # normalized title -> id
+        self.active = set()     # ids of the books in the voting arena
+
+        # Sorted list of the books in the arena, rebuilt only when the set changes
+        self.sortedBooks = []
+
+    @staticmethod
+    def normalize(title):
+        '''Returns the lookup key for a title so near-duplicates land on the same book'''
+        return title.strip().casefold()
+
+    def id(self, title):
+        '''Returns the id for a title, registering it if it's new'''
+        key = self.normalize(title)
+        if key not in self.ids:
+            self.ids[key] = len(self.titles)
+            self.titles.append(title)
+        return self.ids[key]
+
+    def title(self, n):
+        '''Returns the title for id n'''
+        return self.titles[n]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        '''Checks if a book is in the voting arena'''
+        return self.ids.get(self.normalize(title)) in self.active
+
+    def add(self, title):
+        '''Adds a book to the voting arena
+        NOTE: Returns False if the book (or a near-duplicate) is already there'''
+        if title in self:
+            return False
+        self.active.add(self.id(title))
+        self.sortedBooks = sorted(self.titles[n] for n in self.active)
+        return True
+
+    def remove(self, title):
+        '''Removes a book from the voting arena -- its id stays reserved for the ballots'''
+        if title not in self:
+            return False
+        self.active.discard(self.ids[self.normalize(title)])
+        self.sortedBooks = sorted(self.titles[n] for n in self.active)
+        return True
+
+    def sorted(self):
+        '''Returns the books in the voting arena in sorted order'''
+        return self.sortedBooks
+
+class voteStore:
+    '''Books and ballots shared by every session'''
+
+    def __init__(self, log = None):
+        # Sessions run on their own threads
+        self.lock = threading.RLock()
+
+        # Ballot ids keep counting up through resets, so a session holding an id from
+        # before a reset can never remove someone else's ballot with it
+        self.nextId = 1
+        self.clear()
+
+        # Load whatever was saved before a restart
+        # NOTE: Without a log the store only lives in memory
+        self.log = log
+        if log is not None:
+            state, events = log.load()
+            if state is not None:
+                self.restore(state)
+            for event in events:
+                self.apply(event)
+
+    def clear(self):
+        '''Empties the store, except for the next ballot id'''
+        # Every book gets a candidate id when it enters the voting arena
+        self.books = bookRegistry()
+
+        # Ballots are rows of ranks indexed by candidate id -- 0 means not ranked
+        self.ranks = np.zeros((16, 0), dtype = np.int16)
+        self.nRows = 0
+
+        # Every ballot gets an id when it's cast -- removed ballots are left as tombstones
+        # NOTE: nextId isn't reset here, see __init__
+        self.rowIds = np.zeros(16, dtype = np.int64)    # row -> ballot id
+        self.live = np.zeros(16, dtype = bool)          # False once the ballot is removed
+        self.rows = {}                                  # ballot id -> row, for live ballots
+        self.nBallots = 0
+
+        # Running counts kept up to date as ballots come and go
+        self.firstCounts = {}       # candidate id -> ballots with it as their top choice
+        self.rankedCounts = {}      # candidate id -> ballots that rank it at all
+
+        # Bumped on every ballot change so results can be cached per ballot set
+        self.version = 0
+
+        # Unique to this store so a reset never reuses an old fingerprint
+        self.token = uuid.uuid4().hex
+
+    def fingerprint(self):
+        '''Returns a key that changes whenever the set of ballots changes'''
+        return f'{self.token}-{self.version}'
+
+    def record(self, event):
+        '''Writes an event to the log and returns its seq, taking a snapshot when one is due
+        NOTE: Call with the lock held, right after applying the event'''
+        if self.log is None:
+            return 0
+        seq = self.log.append(event)
+        if self.log.due():
+            self.log.snapshot(self.state())
+        return seq
+
+    def durable(self, seq):
+        '''Waits until a logged event is safely on disk
+        NOTE: Call without the lock, so other sessions can log while we wait'''
+        if self.log is not None and seq:
+            self.log.commit(seq)
+
+    def change(self, event):
+        '''Applies an event, logging it if it changed anything
+        NOTE: Returns False if it didn't'''
+        with self.lock:
+            changed = self.apply(event)
+            seq = self.record(event) if changed else 0
+        self.durable(seq)
+        return changed
+
+    def apply(self, event):
+        '''Makes the change an event describes, without logging it -- also used to replay the log'''
+        op = event['op']
+        if op == 'addBook':
+            return self.books.add(event['book'])
+        if op == 'removeBook':
+            return self.books.remove(event['book'])
+        if op == 'addVote':
+            self.insert(event['vote'], event['ballot'])
+            return True
+        if op == 'removeVote':
+            return self.delete(event['ballot'])
+        if op == 'reset':
+            self.clear()
+            return True
+        raise ValueError(f'Unknown event: {op}')
+
+    def addBook(self, book):
+        '''Adds a book to the voting arena
+        NOTE: Returns False if it was already there'''
+        return self.change({'op': 'addBook', 'book': book})
+
+    def removeBook(self, book):
+        '''Removes a book from the voting arena
+        NOTE: Returns False if it wasn't there'''
+        return self.change({'op': 'removeBook', 'book': book})
+
+    def widen(self):
+        '''Adds a column of ranks for any candidates that don't have one yet'''
+        missing = len(self.books) - self.ranks.shape[1]
+        if missing > 0:
+            self.ranks = np.pad(self.ranks, ((0, 0), (0, missing)))
+
+    def encode(self, vote):
+        '''Converts a book -> rank vote into a row of ranks indexed by candidate id'''
+        ranks = {self.books.id(book): rank for book, rank in vote.items() if rank != 0}
+
+        # Make room for any new candidates
+        self.widen()
+
+        row = np.zeros(len(self.books), dtype = np.int16)
+        for n, rank in ranks.items():
+            row[n] = rank
+        return row
+
+    def addVote(self, vote):
+        '''Adds a ballot and returns its ballot id'''
+        with self.lock:
+            ballotId = self.nextId
+            event = {
+                'op'        : 'addVote',
+                'ballot'    : ballotId,
+                'vote'      : {book: int(rank) for book, rank in vote.items() if rank != 0}
+            }
+            self.apply(event)
+            seq = self.record(event)
+        self.durable(seq)
+        return ballotId
+
+    def removeVote(self, ballotId):
+        '''Removes the ballot with the given id
+        NOTE: Returns False if there is no such ballot (or it was removed already)'''
+        return self.change({'op': 'removeVote', 'ballot': int(ballotId)})
+
+    def reset(self):
+        '''Removes every book and ballot -- the log keeps the history up to here'''
+        with self.lock:
+            self.apply({'op': 'reset'})
+            seq = self.record({'op': 'reset'})
+
+            # Nothing before the reset is needed on a restart any more
+            if self.log is not None:
+                self.log.snapshot(self.state())
+        self.durable(seq)
+
+    def insert(self, vote, ballotId):
+        '''Stores a ballot under the given id'''
+        row = self.encode(vote)
+
+        # Double the space when we run out of rows
+        if self.nRows == len(self.ranks):
+            self.ranks = np.concatenate([self.ranks, np.zeros_like(self.ranks)])
+            self.rowIds = np.concatenate([self.rowIds, np.zeros_like(self.rowIds)])
+            self.live = np.concatenate([self.live, np.zeros_like(self.live)])
+
+        self.nextId = max(self.nextId, ballotId + 1)
+
+        self.ranks[self.nRows] = row
+        self.rowIds[self.nRows] = ballotId
+        self.live[self.nRows] = True
+        self.rows[ballotId] = self.nRows
+        self.nRows += 1
+        self.nBallots += 1
+
+        self.count(row, 1)
+        self.version += 1
+
+    def delete(self, ballotId):
+        '''Drops the ballot with the given id
+        NOTE: Returns False if there is no such ballot'''
+        n = self.rows.pop(ballotId, None)
+        if n is None:
+            return False
+
+        # Leave a tombstone in place of the ballot
+        self.live[n] = False
+        self.nBallots -= 1
+        self.count(self.ranks[n], -1)
+        self.version += 1
+
+        # Once tombstones outnumber the ballots, squeeze them out
+        if self.nRows - self.nBallots > max(self.nBallots, 64):
+            self.compact()
+        return True
+
+    def state(self):
+        '''Returns the books and live ballots as arrays for a snapshot'''
+        live = self.live[:self.nRows]
+        return {
+            'meta'      : {
+                'titles'    : self.books.titles,
+                'active'    : sorted(int(n) for n in self.books.active),
+                'nextId'    : self.nextId
+            },
+            'ranks'     : self.ranks[:self.nRows][live],
+            'rowIds'    : self.rowIds[:self.nRows][live]
+        }
+
+    def restore(self, state):
+        '''Loads the books and ballots from a snapshot'''
+        meta = state['meta']
+        for title in meta['titles']:
+            self.books.id(title)
+        for n in meta['active']:
+            self.books.add(self.books.title(n))
+
+        # Room for the ballots plus some to grow
+        ranks = state['ranks']
+        n = len(ranks)
+        size = max(16, 2 * n)
+        self.ranks = np.zeros((size, len(self.books)), dtype = np.int16)
+        self.ranks[:n, :ranks.shape[1]] = ranks
+        self.rowIds = np.zeros(size, dtype = np.int64)
+        self.rowIds[:n] = state['rowIds']
+        self.live = np.zeros(size, dtype = bool)
+        self.live[:n] = True
+        self.nRows = n
+        self.nBallots = n
+        self.rows = {int(ballotId): row for row, ballotId in enumerate(self.rowIds[:n])}
+        self.nextId = meta['nextId']
+
+        # Count the first choices and rankings for all the ballots at once
+        # NOTE: Blank ballots rank nothing, so they don't have a first choice
+        ranked = self.ranks[:n] > 0
+        voting = ranked.any(axis = 1)
+        self.rankedCounts = {i: int(c) for i, c in enumerate(ranked.sum(axis = 0)) if c}
+        self.firstCounts = {}
+        if voting.any():
+            top = np.where(ranked, self.ranks[:n], np.iinfo(np.int16).max)[voting].argmin(axis = 1)
+            self.firstCounts = {i: int(c) for i, c in enumerate(np.bincount(top)) if c}
+        self.version += 1
+
+    def compact(self):
+        '''Drops the tombstones and renumbers the rows of the live ballots'''
+        keep = np.flatnonzero(self.live[:self.nRows])
+        n = len(keep)
+        self.ranks[:n] = self.ranks[keep]
+        self.ranks[n:self.nRows] = 0
+        self.rowIds[:n] = self.rowIds[keep]
+        self.live[:n] = True
+        self.live[n:self.nRows] = False
+        self.nRows = n
+        self.rows = {int(ballotId): row for row, ballotId in enumerate(self.rowIds[:n])}
+
+    def ballotIds(self):
+        '''Returns the ids of the live ballots in the order they were cast'''
+        with self.lock:
+            return self.rowIds[:self.nRows][self.live[:self.nRows]].tolist()
+
+    def count(self, row, step):
+        '''Adds (step = 1) or takes away (step = -1) a ballot from the running counts'''
+        ranked = np.flatnonzero(row)
+        for n in ranked:
+            self.rankedCounts[n] = self.rankedCounts.get(n, 0) + step
+
+        # The top choice is the lowest non-zero rank
+        if len(ranked):
+            top = ranked[np.argmin(row[ranked])]
+            self.firstCounts[top] = self.firstCounts.get(top, 0) + step
+
+    def tally(self):
+        '''Returns the books on the ballots and their first choice votes'''
+        ids = [n for n, count in self.rankedCounts.items() if count > 0]
+        books = [self.books.title(n) for n in ids]
+        votes = [self.firstCounts.get(n, 0) for n in ids]
+        return books, votes
+
+    def firstRound(self):
+        '''Returns the first round of the count as a book/votes/percent dataframe'''
+        with self.lock:
+            books, votes = self.tally()
+        return roundFrame(books, votes)
+
+    def ballots(self):
+        '''Returns every live ballot as a row with its id and a column for each book'''
+        with self.lock:
+            self.widen()
+            live = self.live[:self.nRows]
+            ballots = pl.DataFrame(
+                self.ranks[:self.nRows][live],
+                schema = list(self.books.titles),
+                orient = 'row'
+            )
+            return ballots.insert_column(0, pl.Series('ballot', self.rowIds[:self.nRows][live]))
+
+    def snapshot(self):
+        '''Returns the ballots as a name/book/rank dataframe along with the first round'''
+        with self.lock:
+            live = self.live[:self.nRows]
+            ranks = self.ranks[:self.nRows][live]
+            ballotIds = self.rowIds[:self.nRows][live]
+            candidates = list(self.books.titles)
+            books, votes = self.tally()
+
+        # Pull out the ranked entries -- the columns are built straight from the arrays
+        voters, ids = np.nonzero(ranks)
+        df = pl.DataFrame({
+            'name'  : ballotIds[voters],
+            'book'  : pl.Series(candidates, dtype = pl.String).cast(pl.Enum(candidates)).gather(ids),
+            'rank'  : ranks[voters, ids]
+        })
+
+        return df, roundFrame(books, votes)